@@ -0,0 +1,85 @@
+"""
+Benchmarks quiz question selection at 10k, 100k and 1M questions.
+
+Compares the previous full scan (format every question of the category, filter previous
+questions with a list lookup, random.choice) with IdPool sampling and a walk over a shuffled
+Deck, which draws no random numbers once a quiz has started. The full scan numbers
+exclude the cost of loading the rows from the database, so the real gap is wider.
+
+The second table compares picking a question of a target difficulty, or of the nearest one,
+by scanning the category with the difficulty buckets of QuizIndex.
+
+    python benchmarks/bench_quiz.py
+"""
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flaskr.quiz import IdPool, Deck, QuizIndex  # noqa: E402
+
+SIZES = (10_000, 100_000, 1_000_000)
+PREVIOUS_QUESTIONS = 5
+REPEAT = 5
+
+
+def full_scan(questions, previous_questions):
+    unique_questions = [dict(q) for q in questions if q["id"] not in previous_questions]
+    return random.choice(unique_questions) if unique_questions else None
+
+
+def full_scan_by_difficulty(questions, category, difficulty, previous_questions):
+    unique_questions = [dict(q) for q in questions
+                        if q["category"] == category and q["id"] not in previous_questions]
+    if not unique_questions:
+        return None
+    nearest = min(abs(q["difficulty"] - difficulty) for q in unique_questions)
+    return random.choice([q for q in unique_questions if abs(q["difficulty"] - difficulty) == nearest])
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    print(f"{'questions':>10} {'full scan':>14} {'id pool':>14} {'deck':>14} {'speedup':>10}")
+    for size in SIZES:
+        questions = [{"id": i, "question": "q", "answer": "a", "category": i % 6 + 1, "difficulty": i % 5 + 1}
+                     for i in range(size)]
+        pool = IdPool()
+        deck = Deck()
+        for q in questions:
+            pool.add(q["id"])
+            deck.add(q["id"])
+        previous_questions = random.sample(range(size), PREVIOUS_QUESTIONS)
+        excluded = set(previous_questions)
+        walked = deck.ids[:PREVIOUS_QUESTIONS]
+
+        scan = best_of(lambda: full_scan(questions, previous_questions), number=1)
+        sample = best_of(lambda: pool.sample(excluded), number=10_000)
+        walk = best_of(lambda: deck.pick(walked, set(walked)), number=10_000)
+        print(f"{size:>10} {scan * 1e3:>11.2f} ms {sample * 1e6:>11.2f} us {walk * 1e6:>11.2f} us "
+              f"{scan / walk:>9.0f}x")
+
+    print(f"\n{'questions':>10} {'scan by level':>14} {'buckets':>14} {'speedup':>10}")
+    for size in SIZES:
+        # difficulty 5 is missing in category 1, so picks fall back to the nearest level
+        questions = [{"id": i, "question": "q", "answer": "a", "category": i % 6 + 1, "difficulty": i // 6 % 4 + 1}
+                     for i in range(size)]
+        index = QuizIndex(ttl=float("inf"))
+        for q in questions:
+            index.add(q["id"], q["category"], q["difficulty"])
+        index.loaded_at = time.monotonic()
+        previous_questions = random.sample(range(size), PREVIOUS_QUESTIONS)
+        excluded = set(previous_questions)
+
+        scan = best_of(lambda: full_scan_by_difficulty(questions, 1, 5, previous_questions), number=1)
+        pick = best_of(lambda: index.pick(1, previous_questions, excluded, 5), number=10_000)
+        print(f"{size:>10} {scan * 1e3:>11.2f} ms {pick * 1e6:>11.2f} us {scan / pick:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of ORM versus column tuple serialization for 10, 1k and 100k rows.
+
+Both paths read the same rows from a temporary SQLite database and build the
+format() dicts: the ORM path hydrates Question instances and calls format(),
+the column path selects plain tuples through question_rows() and calls format_row().
+The session is removed after every run so the identity map never serves rows from memory.
+The snapshot column reads a page of the same size from the columnar snapshot of QUESTION_STORE=snapshot.
+
+    python benchmarks/bench_reads.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask  # noqa: E402
+
+from flaskr.reads import question_rows, format_row  # noqa: E402
+from flaskr.snapshot import build_snapshot, Snapshot  # noqa: E402
+from models import setup_db, db, Question  # noqa: E402
+
+SIZES = (10, 1_000, 100_000)
+REPEAT = 5
+
+
+def orm_read(limit):
+    questions = [q.format() for q in Question.query.order_by(Question.id).limit(limit)]
+    db.session.remove()
+    return questions
+
+
+def column_read(limit):
+    questions = [format_row(row) for row in question_rows().order_by(Question.id).limit(limit)]
+    db.session.remove()
+    return questions
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        setup_db(app, f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        with app.app_context():
+            db.create_all()
+            db.session.execute(Question.__table__.insert(), [
+                {"question": f"Question number {i}?", "answer": f"Answer {i}", "category": i % 6 + 1,
+                 "difficulty": i % 5 + 1} for i in range(max(SIZES))
+            ])
+            db.session.commit()
+
+            assert orm_read(100) == column_read(100)
+            snapshot = Snapshot(build_snapshot(column_read(None), {}))
+
+            print(f"{'rows':>8} {'ORM':>12} {'columns':>12} {'speedup':>8} {'snapshot':>12} {'speedup':>8}")
+            for size in SIZES:
+                number = max(1, 10_000 // size)
+                orm = best_of(lambda: orm_read(size), number)
+                columns = best_of(lambda: column_read(size), number)
+                snapshot_page = best_of(lambda: snapshot.questions_page(size), number)
+                print(f"{size:>8} {orm * 1e3:>9.3f} ms {columns * 1e3:>9.3f} ms {orm / columns:>7.1f}x "
+                      f"{snapshot_page * 1e3:>9.3f} ms {orm / snapshot_page:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
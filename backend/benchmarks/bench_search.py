@@ -0,0 +1,86 @@
+"""
+Benchmarks question search on a synthetic bank of 100k questions.
+
+Compares the former `question ILIKE '%term%'` sequential scan, run by SQLite as
+`LIKE` (case-insensitive there), with the in-memory TrigramIndex used when the
+Postgres full-text columns are not available.
+The second table times GET /questions/suggest lookups in the SuggestIndex prefix index,
+which return the first 10 matches as the user types.
+
+    python benchmarks/bench_search.py
+"""
+import os
+import random
+import sqlite3
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flaskr.search import TrigramIndex  # noqa: E402
+from flaskr.suggest import SuggestIndex  # noqa: E402
+
+SIZE = 100_000
+WORDS_PER_QUESTION = 10
+VOCABULARY = 20_000
+REPEAT = 5
+
+
+def make_word(rng):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    rng = random.Random(42)
+    vocabulary = [make_word(rng) for _ in range(VOCABULARY)]
+    questions = [" ".join(rng.choice(vocabulary) for _ in range(WORDS_PER_QUESTION)).capitalize() + "?"
+                 for _ in range(SIZE)]
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE questions (id INTEGER PRIMARY KEY, question TEXT)")
+    connection.executemany("INSERT INTO questions VALUES (?, ?)", enumerate(questions, 1))
+    index = TrigramIndex()
+    for id, text in enumerate(questions, 1):
+        index.add(id, text)
+
+    terms = {
+        "word": vocabulary[0],
+        "phrase": " ".join(questions[0].split()[2:4]),
+        "prefix": vocabulary[1][:3],
+        "miss": "zzzzqqq"
+    }
+    print(f"{SIZE} questions")
+    print(f"{'term':>8} {'matches':>8} {'ILIKE scan':>12} {'trigram index':>14} {'speedup':>8}")
+    for name, term in terms.items():
+        pattern = f"%{term}%"
+        like = best_of(lambda: connection.execute("SELECT id FROM questions WHERE question LIKE ?",
+                                                  (pattern,)).fetchall(), number=3)
+        trigram = best_of(lambda: index.search(term), number=3)
+        matches = len(index.search(term))
+        print(f"{name:>8} {matches:>8} {like * 1e3:>9.2f} ms {trigram * 1e3:>11.2f} ms {like / trigram:>7.1f}x")
+
+    suggest_index = SuggestIndex(ttl=float("inf"))
+    for id, text in enumerate(questions, 1):
+        suggest_index.add(id, text)
+    suggest_index.loaded_at = 0
+    queries = {
+        "1 letter": vocabulary[0][:1],
+        "prefix": vocabulary[1][:3],
+        "word": vocabulary[0],
+        "2 words": " ".join(questions[0].split()[2:4])[:-1],
+        "miss": "zzzzqqq"
+    }
+    print(f"\n{'query':>8} {'suggestions':>12} {'suggest':>12}")
+    for name, query in queries.items():
+        suggest = best_of(lambda: suggest_index.suggest(query), number=1000)
+        print(f"{name:>8} {len(suggest_index.suggest(query)):>12} {suggest * 1e6:>9.1f} us")
+    stats = suggest_index.stats()
+    print(f"{stats['tokens']} tokens, about {stats['bytes'] / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
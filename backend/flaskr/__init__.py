@@ -1,21 +1,115 @@
-from flask import Flask, request, abort, jsonify
-from flask_cors import CORS
+import io
+import os
 import random
+from concurrent.futures import TimeoutError
+
+import click
+from flask import Flask, request, abort, jsonify, stream_with_context
+from flask_cors import CORS
 
-from models import setup_db, Question, Category
+from models import db, setup_db, add_question_listener, add_category_listener, pool_metrics, ping, Question
+from . import bulk
+from .cache import create_response_cache, ALL_QUESTIONS, RESPONSE_CACHE_TTL, MAX_ENTRIES
+from .categories import CategoryCache
+from .migrations import migrate
+from .negotiation import init_negotiation, response_format, representation_etag, columnar, encode, JSON, \
+    COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL
+from .counts import QuestionCounts
+from .pagination import paginate, encode_cursor, decode_cursor, InvalidCursor
+from .quiz import QuizIndex, quiz_strategy
+from .reads import question_rows, format_row
+from .replicas import init_replicas, read_only, pinned_to_primary
+from .search import QuestionSearch
+from .sessions import create_session_store, new_session_id, SeenQuestions, SESSION_TTL, \
+    DEFAULT_SESSION_STORE
+from .snapshot import create_question_store, SNAPSHOT_TTL
+from .streaming import peek, stream_json, STREAM_BATCH_SIZE
+from .suggest import SuggestIndex, SUGGEST_LIMIT, MAX_SUGGEST_LIMIT, MAX_TOKENS, MAX_IDS_PER_TOKEN
+from .writes import create_write_pipeline, QueueFull, WRITE_QUEUE_SIZE, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY, \
+    WRITE_TIMEOUT
 
 QUESTIONS_PER_PAGE = 10
 BAD_REQUEST = "Bad Request"
 NOT_FOUND = "Not Found"
 UNPROCESSABLE_ENTITY = "Unprocessable Entity"
+TOO_MANY_REQUESTS = "Too Many Requests"
 INTERNAL_SERVER_ERROR = "Internal Server Error"
+SERVICE_UNAVAILABLE = "Service Unavailable"
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        QUIZ_ORDER="deck",
+        QUIZ_SEED=None,
+        QUIZ_SESSION_STORE=DEFAULT_SESSION_STORE,
+        QUIZ_SESSION_TTL=SESSION_TTL,
+        SEARCH_ENGINE="auto",
+        COUNTS_MODE="exact",
+        RESPONSE_CACHE="memory",
+        RESPONSE_CACHE_TTL=RESPONSE_CACHE_TTL,
+        RESPONSE_CACHE_MAX_ENTRIES=MAX_ENTRIES,
+        INSTRUMENTATION=False,
+        PROFILE_SAMPLE_RATE=0.0,
+        PROFILE_DIR="profiles",
+        PROFILE_KEEP=20,
+        WARM_UP=False,
+        COMPRESSION=True,
+        COMPRESSION_MIN_SIZE=COMPRESSION_MIN_SIZE,
+        COMPRESSION_LEVEL=COMPRESSION_LEVEL,
+        WRITE_MODE="group",
+        WRITE_QUEUE_SIZE=WRITE_QUEUE_SIZE,
+        WRITE_BATCH_SIZE=WRITE_BATCH_SIZE,
+        WRITE_BATCH_DELAY=WRITE_BATCH_DELAY,
+        WRITE_TIMEOUT=WRITE_TIMEOUT,
+        QUESTION_STORE="database",
+        SNAPSHOT_DIR=None,
+        SNAPSHOT_TTL=SNAPSHOT_TTL,
+        SUGGEST_MAX_TOKENS=MAX_TOKENS,
+        SUGGEST_MAX_IDS_PER_TOKEN=MAX_IDS_PER_TOKEN
+    )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
     setup_db(app)
     CORS(app, resources={r"/categories|questions|quizzes/*": {"origins": "*"}})
+    init_negotiation(app)
+
+    question_store = create_question_store(app.config["QUESTION_STORE"], app.config["SQLALCHEMY_DATABASE_URI"],
+                                           app.config["SNAPSHOT_DIR"], app.config["SNAPSHOT_TTL"])
+    if question_store is not None:
+        add_question_listener(app, question_store.on_question_change)
+        add_category_listener(app, question_store.on_category_change)
+    quiz_seed = app.config["QUIZ_SEED"]
+    quiz_index = QuizIndex(rng=random.Random(quiz_seed) if quiz_seed is not None else None,
+                           order=app.config["QUIZ_ORDER"], store=question_store)
+    add_question_listener(app, quiz_index.on_question_change)
+    session_store = create_session_store(app.config["QUIZ_SESSION_STORE"], app.config["QUIZ_SESSION_TTL"])
+    question_search = QuestionSearch(app.config["SEARCH_ENGINE"])
+    add_question_listener(app, question_search.on_question_change)
+    suggest_index = SuggestIndex(max_tokens=app.config["SUGGEST_MAX_TOKENS"],
+                                 max_ids_per_token=app.config["SUGGEST_MAX_IDS_PER_TOKEN"])
+    add_question_listener(app, suggest_index.on_question_change)
+    category_cache = CategoryCache()
+    add_category_listener(app, category_cache.invalidate)
+    question_counts = QuestionCounts(app.config["COUNTS_MODE"])
+    add_question_listener(app, question_counts.on_question_change)
+    response_cache = create_response_cache(app.config["RESPONSE_CACHE"], app.config["RESPONSE_CACHE_TTL"],
+                                           app.config["RESPONSE_CACHE_MAX_ENTRIES"], bypass=pinned_to_primary)
+    add_question_listener(app, response_cache.on_question_change)
+    add_category_listener(app, response_cache.on_category_change)
+    app.extensions["response_cache"] = response_cache
+    app.extensions["quiz_index"] = quiz_index
+    app.extensions["question_search"] = question_search
+    app.extensions["suggest_index"] = suggest_index
+    app.extensions["quiz_sessions"] = session_store
+    app.extensions["question_store"] = question_store
+    replicas = init_replicas(app)
+    writes = create_write_pipeline(app, app.config["WRITE_MODE"], app.config["WRITE_QUEUE_SIZE"],
+                                   app.config["WRITE_BATCH_SIZE"], app.config["WRITE_BATCH_DELAY"])
+    app.extensions["replicas"] = replicas
+    app.extensions["writes"] = writes
 
     @app.after_request
     def after_request(response):
@@ -23,50 +117,106 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods', 'GET,POST,DELETE,OPTIONS')
         return response
 
+    if app.config["INSTRUMENTATION"]:
+        # imported on demand, it pulls in cProfile
+        from .instrumentation import init_instrumentation
+        init_instrumentation(app)
+
+    def get_category_listing():
+        if question_store is not None:
+            return question_store.current().category_listing()
+        return category_cache.get()
+
     def get_serialized_categories():
         try:
-            categories = Category.query.order_by(Category.id).all()
-            serialized_categories = {c.id: c.type for c in categories}
+            serialized_categories, _, _ = get_category_listing()
             return serialized_categories
         except:
             abort(500)
 
-    def get_questions_per_page(page):
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        questions = Question.query.order_by(Question.difficulty).all()
-        serialized_questions = [q.format() for q in questions]
-        return serialized_questions[start:end]
+    def get_total_questions():
+        if question_store is not None:
+            return question_store.current().total()
+        return question_counts.total()
+
+    def get_questions_per_page(page, after=None):
+        if question_store is not None:
+            serialized_questions, next_cursor = question_store.current().questions_page(QUESTIONS_PER_PAGE, page, after)
+            return serialized_questions, {"next_cursor": next_cursor}
+        rows, next_cursor = paginate(question_rows(), QUESTIONS_PER_PAGE, page=page, after=after)
+        serialized_questions = [format_row(row) for row in rows]
+        return serialized_questions, {"next_cursor": next_cursor}
+
+    def stream_questions(serialized_questions, **fields):
+        mimetype = response_format()
+        if mimetype != JSON:
+            data = {"success": True, **fields, "questions": columnar(serialized_questions)}
+            return app.response_class(encode(data, mimetype), mimetype=mimetype)
+        body = stream_json({"success": True, **fields}, "questions", serialized_questions)
+        return app.response_class(stream_with_context(body), mimetype=JSON)
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        try:
+            ping()
+        except:
+            abort(503)
 
-    @app.route("/categories", methods=["GET"])
-    def get_categories():
         return jsonify({
             "success": True,
-            "categories": get_serialized_categories()
+            "database": "ok",
+            "pool": pool_metrics(),
+            "cache": response_cache.stats(),
+            "replicas": replicas.status() if replicas is not None else [],
+            "writes": writes.stats(),
+            "store": question_store.stats() if question_store is not None else None,
+            "suggest": suggest_index.stats()
         })
 
+    @app.route("/categories", methods=["GET"])
+    @read_only
+    def get_categories():
+        try:
+            _, body, etag = get_category_listing()
+        except:
+            abort(500)
+
+        response = app.response_class(body, mimetype="application/json")
+        response.set_etag(representation_etag(etag))
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
     @app.route("/questions", methods=["GET"])
+    @read_only
     def get_questions():
         try:
             page = request.args.get('page', 1, type=int)
+            after = request.args.get('after')
         except:
             abort(400)
 
         if page < 1:
             abort(422)
 
-        questions = get_questions_per_page(page)
+        try:
+            # a cursor takes precedence over the page
+            args = {"after": after} if after else {"page": page}
+            questions, fields = response_cache.listing("/questions", args, (ALL_QUESTIONS,),
+                                                       lambda: get_questions_per_page(page, after))
+        except InvalidCursor:
+            abort(400)
+        except:
+            abort(500)
+
         if not questions:
             abort(404)
 
         try:
-            return jsonify({
-                "success": True,
-                "questions": questions,
-                "total_questions": Question.query.count(),
-                "categories": get_serialized_categories(),
-                "current_category": None
-            })
+            return stream_questions(questions,
+                                    total_questions=get_total_questions(),
+                                    categories=get_serialized_categories(),
+                                    current_category=None,
+                                    next_cursor=fields["next_cursor"])
         except:
             abort(500)
 
@@ -91,20 +241,118 @@ def create_app(test_config=None):
             abort(400)
 
         try:
-            new_question = Question(question=data["question"],
-                                    answer=data["answer"],
-                                    category=data["category"],
-                                    difficulty=data["difficulty"])
-            new_question.insert()
+            pending = writes.submit({"question": data["question"],
+                                     "answer": data["answer"],
+                                     "category": int(data["category"]),
+                                     "difficulty": int(data["difficulty"])})
+        except QueueFull:
+            abort(429)
+        except:
+            abort(500)
+
+        try:
+            id = pending.result(timeout=app.config["WRITE_TIMEOUT"])
+        except TimeoutError:
+            abort(503)
         except:
             abort(500)
 
         return jsonify({
             "success": True,
-            "id": new_question.id
+            "id": id
         })
 
+    @app.route("/questions/batch", methods=["POST"])
+    def batch_questions():
+        try:
+            data = request.get_json()
+            deletes = data.get("delete", [])
+            inserts = data.get("insert", [])
+            updates = data.get("update", [])
+            well_formed = all(bulk.is_question_id(id) for id in deletes) \
+                and all(isinstance(item, dict) for item in inserts + updates) \
+                and all(bulk.is_question_id(item.get("id")) for item in updates)
+        except:
+            abort(400)
+
+        if not well_formed:
+            abort(400)
+
+        if len(deletes) + len(inserts) + len(updates) > bulk.MAX_BATCH_ITEMS:
+            abort(422)
+
+        try:
+            results = bulk.apply_batch(deletes, inserts, updates)
+        except:
+            abort(500)
+
+        return jsonify({
+            "success": True,
+            "deleted": sum(result["status"] == "deleted" for result in results["delete"]),
+            "inserted": sum(result["status"] == "inserted" for result in results["insert"]),
+            "updated": sum(result["status"] == "updated" for result in results["update"]),
+            "results": results
+        })
+
+    @app.route("/questions/import", methods=["POST"])
+    def import_questions():
+        format = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+        if format not in bulk.FORMATS:
+            abort(422)
+
+        try:
+            lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+            summary = bulk.import_questions(lines, format)
+        except:
+            abort(500)
+
+        return jsonify({
+            "success": True,
+            **summary
+        })
+
+    @app.route("/questions/export", methods=["GET"])
+    @read_only
+    def export_questions():
+        format = request.args.get("format", "ndjson")
+        if format not in bulk.FORMATS:
+            abort(422)
+
+        mimetype = "text/csv" if format == "csv" else "application/x-ndjson"
+        response = app.response_class(stream_with_context(bulk.export_questions(format)), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename=questions.{format}"
+        return response
+
+    @app.cli.command("import-questions")
+    @click.argument("file", type=click.File("r", encoding="utf-8"))
+    @click.option("--format", type=click.Choice(bulk.FORMATS), help="Defaults to the file extension.")
+    def import_questions_command(file, format):
+        """Import questions from an NDJSON or CSV file."""
+        format = format or ("csv" if file.name.endswith(".csv") else "ndjson")
+        summary = bulk.import_questions(file, format)
+        for error in summary["errors"]:
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+        click.echo(f"Imported {summary['inserted']} questions, {summary['failed']} failed.")
+
+    @app.cli.command("export-questions")
+    @click.argument("file", type=click.File("w", encoding="utf-8"))
+    @click.option("--format", type=click.Choice(bulk.FORMATS), help="Defaults to the file extension.")
+    def export_questions_command(file, format):
+        """Export all questions to an NDJSON or CSV file."""
+        format = format or ("csv" if os.path.splitext(file.name)[1] == ".csv" else "ndjson")
+        for chunk in bulk.export_questions(format):
+            file.write(chunk)
+
+    @app.cli.command("migrate")
+    def migrate_command():
+        """Apply pending schema migrations."""
+        applied = migrate(db.engine)
+        for version in applied:
+            click.echo(f"Applied {version}")
+        click.echo(f"{len(applied)} migrations applied.")
+
     @app.route("/questions/search", methods=["POST"])
+    @read_only
     def search_question():
         try:
             data = request.get_json()
@@ -113,68 +361,206 @@ def create_app(test_config=None):
 
         try:
             search_term = data['searchTerm'].strip()
-            questions = Question.query.filter(Question.question.ilike(f"%{search_term}%")).all()
-            serialized_questions = [q.format() for q in questions]
-            total_questions = Question.query.count()
+            page, cursor, limit = data.get('page'), data.get('cursor'), data.get('limit')
+            paginated = page is not None or cursor is not None or limit is not None
+            if paginated:
+                limit = int(limit) if limit is not None else QUESTIONS_PER_PAGE
+                offset = decode_cursor(cursor, size=1)[0] if cursor else (int(page or 1) - 1) * limit
+        except InvalidCursor:
+            abort(400)
+        except:
+            abort(500)
+
+        if paginated and (limit < 1 or offset < 0):
+            abort(422)
+
+        def search():
+            source = question_store.current() if question_store is not None else question_search
+            next_page, next_cursor = None, None
+            if paginated:
+                # one extra row tells whether a next page exists
+                serialized_questions = list(source.search(search_term, offset=offset, limit=limit + 1))
+                if len(serialized_questions) > limit:
+                    serialized_questions = serialized_questions[:limit]
+                    next_page = offset // limit + 2
+                    next_cursor = encode_cursor(offset + limit)
+            else:
+                serialized_questions = source.search(search_term)
+            return serialized_questions, {"next_page": next_page, "next_cursor": next_cursor}
+
+        try:
+            total_questions = get_total_questions()
+            args = {"term": search_term.lower()}
+            if paginated:
+                args.update(offset=offset, limit=limit)
+            serialized_questions, fields = response_cache.listing("/questions/search", args, (ALL_QUESTIONS,), search)
+        except:
+            abort(500)
+
+        return stream_questions(serialized_questions,
+                                total_questions=total_questions,
+                                current_category=None,
+                                **fields)
+
+    @app.route("/questions/suggest", methods=["GET"])
+    @read_only
+    def suggest_questions():
+        query = request.args.get('q')
+        limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+        if query is None:
+            abort(400)
+
+        if not 1 <= limit <= MAX_SUGGEST_LIMIT:
+            abort(422)
+
+        try:
+            suggestions = suggest_index.suggest(query, limit)
         except:
             abort(500)
 
         return jsonify({
             "success": True,
-            "questions": serialized_questions,
-            "total_questions": total_questions,
-            "current_category": None
+            "suggestions": suggestions
         })
 
     @app.route("/categories/<int:id>/questions", methods=["GET"])
+    @read_only
     def get_questions_by_category(id):
         if id < 1:
             abort(422)
+
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('after')
+        if limit is not None and limit < 1:
+            abort(422)
+
+        def get_category_questions():
+            if question_store is not None:
+                questions, next_cursor = question_store.current().category_questions(id, limit, after)
+                return questions, {"next_cursor": next_cursor}
+            query = question_rows().filter(Question.category == id)
+            if limit is None:
+                rows = query.order_by(Question.difficulty, Question.id).yield_per(STREAM_BATCH_SIZE)
+                next_cursor = None
+            else:
+                rows, next_cursor = paginate(query, limit, after=after)
+            return (format_row(row) for row in rows), {"next_cursor": next_cursor}
+
         try:
-            questions = Question.query.filter(Question.category == id).order_by(Question.difficulty.asc()).all()
-            serialized_questions = [q.format() for q in questions]
-            total_questions = Question.query.count()
+            questions, fields = response_cache.listing(f"/categories/{id}/questions", {"limit": limit, "after": after},
+                                                       (f"category:{id}",), get_category_questions)
+            first, serialized_questions = peek(questions)
+            total_questions = get_total_questions()
+        except InvalidCursor:
+            abort(400)
         except:
             abort(500)
 
-        if not serialized_questions:
+        if first is None:
             abort(404)
 
-        return jsonify({
-            "success": True,
-            "questions": serialized_questions,
-            "total_questions": total_questions,
-            "current_category": None
-        })
+        return stream_questions(serialized_questions,
+                                total_questions=total_questions,
+                                current_category=None,
+                                **fields)
 
     @app.route("/quizzes", methods=["POST"])
+    @read_only
     def get_questions_for_quiz():
         try:
             data = request.get_json()
-            category_id = data["quiz_category"]["id"]
+            category_id = int(data["quiz_category"]["id"])
             prev_questions = data["previous_questions"]
+            strategy, difficulty, answers = quiz_strategy(data)
         except:
             abort(400)
 
-        if int(category_id) < 0:
+        if category_id < 0:
             abort(422)
 
         try:
-            if int(category_id) == 0:
-                questions_by_category = Question.query.all()
-            else:
-                questions_by_category = Question.query.filter(Question.category == category_id).all()
+            questions_in_category = quiz_index.count(category_id)
+            difficulty = quiz_index.target_difficulty(strategy, difficulty, prev_questions, answers)
+            question = quiz_index.next_question(category_id, prev_questions, difficulty) \
+                if questions_in_category else None
         except:
             abort(500)
 
-        if not questions_by_category:
+        if not questions_in_category:
             abort(404)
 
-        unique_questions = [q.format() for q in questions_by_category if q.id not in prev_questions]
+        return jsonify({
+            "success": True,
+            "question": question
+        })
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    @read_only
+    def start_quiz_session():
+        try:
+            data = request.get_json()
+            category_id = int(data["quiz_category"]["id"])
+        except:
+            abort(400)
+
+        if category_id < 0:
+            abort(422)
+
+        try:
+            questions_in_category = quiz_index.count(category_id)
+        except:
+            abort(500)
+
+        if not questions_in_category:
+            abort(404)
+
+        session_id = new_session_id()
+        session_store.create(session_id, category_id)
+
+        return jsonify({
+            "success": True,
+            "session_id": session_id,
+            "total_questions": questions_in_category
+        })
+
+    @app.route("/quizzes/sessions/<session_id>/next", methods=["POST"])
+    @read_only
+    def next_quiz_session_question(session_id):
+        session = session_store.get(session_id)
+        if session is None:
+            abort(404)
+
+        try:
+            seen = SeenQuestions(session_store, session_id, session)
+            while True:
+                question = quiz_index.next_question(session["category"], seen, excluded=seen)
+                # False when another request of the session asked it meanwhile, None when the session is gone
+                claimed = session_store.claim(session_id, question["id"]) if question is not None else True
+                if claimed is not False:
+                    break
+        except:
+            abort(500)
+
+        if claimed is None:
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "question": question
+        })
+
+    @app.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+    def finish_quiz_session(session_id):
+        session = session_store.get(session_id)
+        if session is None:
+            abort(404)
+
+        session_store.delete(session_id)
 
         return jsonify({
             "success": True,
-            "question": random.choice(unique_questions) if unique_questions else None
+            "session_id": session_id,
+            "questions_asked": session["asked"]
         })
 
     @app.errorhandler(400)
@@ -201,6 +587,14 @@ def create_app(test_config=None):
             "message": UNPROCESSABLE_ENTITY
         }), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({
+            "success": False,
+            "error": 429,
+            "message": TOO_MANY_REQUESTS
+        }), 429
+
     @app.errorhandler(500)
     def server_error(error):
         return jsonify({
@@ -209,4 +603,23 @@ def create_app(test_config=None):
             "message": INTERNAL_SERVER_ERROR
         }), 500
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": SERVICE_UNAVAILABLE
+        }), 503
+
+    if app.config["WARM_UP"]:
+        # with gunicorn --preload this runs once before the workers fork and they share the loaded caches
+        try:
+            with app.app_context():
+                get_category_listing()
+                suggest_index.ensure_loaded()
+                # connections opened before a fork must not be shared by the workers
+                db.engine.dispose()
+        except Exception as error:
+            app.logger.warning("Warm up skipped: %s", error)
+
     return app
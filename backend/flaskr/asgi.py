@@ -0,0 +1,344 @@
+import asyncio
+import io
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+from werkzeug.test import EnvironBuilder
+
+from models import create_async_engine, Question
+from . import create_app, BAD_REQUEST, NOT_FOUND, UNPROCESSABLE_ENTITY, INTERNAL_SERVER_ERROR
+from .quiz import quiz_strategy
+from .reads import QUESTION_COLUMNS, format_row
+from .sessions import SeenQuestions
+
+WSGI_THREADS = 32
+MESSAGES = {400: BAD_REQUEST, 404: NOT_FOUND, 422: UNPROCESSABLE_ENTITY, 500: INTERNAL_SERVER_ERROR}
+HEADERS = (
+    (b"content-type", b"application/json"),
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type,Authorization,true"),
+    (b"access-control-allow-methods", b"GET,POST,DELETE,OPTIONS")
+)
+
+'''
+ASGI serving mode, e.g. `uvicorn --factory flaskr.asgi:create_asgi_app`.
+
+The quiz player endpoints (POST /quizzes and POST /quizzes/sessions/<session_id>/next)
+are served natively on the event loop: the next question is picked from the in-memory
+quiz index and fetched through an async engine (asyncpg, or aiosqlite for sqlite), so a
+waiting player holds neither a thread nor a connection.
+Every other route is handed to the Flask app from create_app in a thread pool, so both
+modes share the same routes, JSON contract, error handlers and in-memory indexes.
+Natively served requests skip the Flask request hooks, including instrumentation.
+'''
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class AsyncTrivia:
+    '''
+    AsyncTrivia(app)
+        the ASGI application in front of a Flask app made by create_app.
+    '''
+
+    def __init__(self, app, threads=WSGI_THREADS):
+        self.app = app
+        self.quiz_index = app.extensions["quiz_index"]
+        self.session_store = app.extensions["quiz_sessions"]
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+        self.engine = None
+        self.test_loop = None
+        self.routes = (
+            ("POST", re.compile(r"^/quizzes$"), self.next_quiz_question),
+            ("POST", re.compile(r"^/quizzes/sessions/(?P<session_id>[^/]+)/next$"), self.next_session_question)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+        body = await read_body(receive)
+        for method, pattern, handler in self.routes:
+            match = pattern.match(scope["path"])
+            if match and scope["method"] == method:
+                try:
+                    status, data = 200, await handler(body, **match.groupdict())
+                except HTTPError as error:
+                    status, data = error.status, {"success": False, "error": error.status,
+                                                  "message": MESSAGES[error.status]}
+                await send_json(send, status, data)
+                return
+
+        await self.call_wsgi(scope, body, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def get_engine(self):
+        # created on first use so the database settings can still change after create_app
+        if self.engine is None:
+            self.engine = create_async_engine(self.app)
+        return self.engine
+
+    async def run_sync(self, function, *args):
+        def run():
+            with self.app.app_context():
+                return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, run)
+
+    async def get_question(self, id):
+        async with self.get_engine().connect() as connection:
+            result = await connection.execute(select(*QUESTION_COLUMNS).where(Question.id == id))
+            row = result.first()
+        return format_row(row) if row is not None else None
+
+    async def ensure_quiz_index(self):
+        # the index loads through the sync session, off the event loop
+        if self.quiz_index.is_stale():
+            await self.run_sync(self.quiz_index.ensure_loaded)
+
+    async def next_question(self, category, previous_questions, difficulty=None, excluded=None):
+        '''
+        next_question(category, previous_questions, difficulty, excluded)
+            the async twin of QuizIndex.next_question.
+        '''
+        await self.ensure_quiz_index()
+        if excluded is None:
+            excluded = set(previous_questions)
+        while True:
+            if isinstance(excluded, SeenQuestions):
+                # the questions of a session are looked up in its store, which blocks
+                id = await self.run_sync(self.quiz_index.pick, category, previous_questions, excluded, difficulty)
+            else:
+                id = self.quiz_index.pick(category, previous_questions, excluded, difficulty)
+            if id is None:
+                return None
+            question = await self.get_question(id)
+            if question is not None:
+                return question
+            # read on the primary, so deleted by another process since the index was loaded
+            self.quiz_index.remove(id)
+
+    async def next_quiz_question(self, body):
+        try:
+            data = json.loads(body)
+            category_id = int(data["quiz_category"]["id"])
+            prev_questions = data["previous_questions"]
+            strategy, difficulty, answers = quiz_strategy(data)
+        except:
+            raise HTTPError(400)
+
+        if category_id < 0:
+            raise HTTPError(422)
+
+        try:
+            await self.ensure_quiz_index()
+            questions_in_category = self.quiz_index.count(category_id)
+            difficulty = self.quiz_index.target_difficulty(strategy, difficulty, prev_questions, answers)
+            question = await self.next_question(category_id, prev_questions, difficulty) \
+                if questions_in_category else None
+        except:
+            raise HTTPError(500)
+
+        if not questions_in_category:
+            raise HTTPError(404)
+
+        return {
+            "success": True,
+            "question": question
+        }
+
+    async def next_session_question(self, body, session_id):
+        # the session store may block on its file, it runs on the executor like the sync views
+        session = await self.run_sync(self.session_store.get, session_id)
+        if session is None:
+            raise HTTPError(404)
+
+        try:
+            seen = SeenQuestions(self.session_store, session_id, session)
+            while True:
+                question = await self.next_question(session["category"], seen, excluded=seen)
+                # False when another request of the session asked it meanwhile, None when the session is gone
+                claimed = await self.run_sync(self.session_store.claim, session_id, question["id"]) \
+                    if question is not None else True
+                if claimed is not False:
+                    break
+        except:
+            raise HTTPError(500)
+
+        if claimed is None:
+            raise HTTPError(404)
+
+        return {
+            "success": True,
+            "question": question
+        }
+
+    async def call_wsgi(self, scope, body, send):
+        '''
+        call_wsgi(scope, body, send)
+            runs the Flask app for one request in the thread pool. The response is iterated in the
+            same thread, which streamed responses need, and every chunk is sent as it is produced.
+        '''
+        loop = asyncio.get_running_loop()
+        environ = wsgi_environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            chunks = self.app.wsgi_app(environ, start_response)
+            started = False
+            try:
+                for chunk in chunks:
+                    if not started:
+                        emit({"type": "http.response.start", "status": response["status"],
+                              "headers": response["headers"]})
+                        started = True
+                    if chunk:
+                        emit({"type": "http.response.body", "body": chunk, "more_body": True})
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+            if not started:
+                emit({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+            emit({"type": "http.response.body", "body": b""})
+
+        await loop.run_in_executor(self.executor, run)
+
+    def test_client(self):
+        if self.test_loop is None:
+            self.test_loop = asyncio.new_event_loop()
+        return AsgiTestClient(self, self.test_loop)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status, data):
+    payload = (json.dumps(data) + "\n").encode()
+    headers = HEADERS + ((b"content-length", str(len(payload)).encode()),)
+    await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+    await send({"type": "http.response.body", "body": payload})
+
+
+def wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("127.0.0.1", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiTestClient:
+    '''
+    AsgiTestClient(asgi_app, loop)
+        calls the ASGI app in process with the get/post/delete/open interface of the Flask
+        test client, so the same tests run against both serving modes.
+    '''
+
+    def __init__(self, asgi_app, loop):
+        self.asgi_app = asgi_app
+        self.loop = loop
+
+    def open(self, path, method="GET", **kwargs):
+        environ = EnvironBuilder(path, method=method, **kwargs).get_environ()
+        headers = [(key[5:].replace("_", "-").lower().encode("latin-1"), value.encode("latin-1"))
+                   for key, value in environ.items() if key.startswith("HTTP_")]
+        for key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            if environ.get(key):
+                headers.append((key.replace("_", "-").lower().encode("latin-1"), environ[key].encode("latin-1")))
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": environ["REQUEST_METHOD"],
+            "scheme": "http",
+            "path": environ["PATH_INFO"].encode("latin-1").decode(),
+            "root_path": "",
+            "query_string": environ["QUERY_STRING"].encode("latin-1"),
+            "headers": headers,
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 0)
+        }
+        body = environ["wsgi.input"].read()
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.asgi_app(scope, receive, send))
+        start = messages[0]
+        return self.asgi_app.app.response_class(
+            b"".join(message.get("body", b"") for message in messages[1:]),
+            status=start["status"],
+            headers=[(name.decode("latin-1"), value.decode("latin-1")) for name, value in start["headers"]]
+        )
+
+    def get(self, path, **kwargs):
+        return self.open(path, method="GET", **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, method="POST", **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, method="DELETE", **kwargs)
+
+
+def create_asgi_app(test_config=None):
+    return AsyncTrivia(create_app(test_config))
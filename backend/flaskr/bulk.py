@@ -0,0 +1,245 @@
+import csv
+import io
+import json
+
+from sqlalchemy import bindparam, select
+
+from models import db, notify_question_listeners, Question, Category
+
+IMPORT_BATCH_SIZE = 1000
+MAX_BATCH_ITEMS = 1000
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FIELDS = ("question", "answer", "category", "difficulty")
+FORMATS = ("ndjson", "csv")
+
+'''
+Bulk import and export of questions as NDJSON (one JSON object per line) or CSV with a header row.
+
+Imports are read as a stream, validated row by row and inserted in batches with one
+commit per batch. Invalid rows are reported with their line number and skipped.
+Exports are generated row by row from a server side cursor and never held in memory.
+Batches of deletes, inserts and updates run as a few set based statements in one transaction.
+'''
+
+
+def read_rows(lines, format):
+    '''
+    read_rows(lines, format)
+        yields (line number, row dict or None, error or None) from an iterable of text lines.
+    '''
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_number, None, f"Invalid JSON: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, row, None
+
+
+def validate(row, category_ids):
+    question = row.get("question")
+    answer = row.get("answer")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("question is required")
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError("answer is required")
+    try:
+        category = int(row.get("category"))
+        difficulty = int(row.get("difficulty"))
+    except (TypeError, ValueError):
+        raise ValueError("category and difficulty must be integers")
+    if category not in category_ids:
+        raise ValueError(f"unknown category {category}")
+    if not 1 <= difficulty <= 5:
+        raise ValueError("difficulty must be between 1 and 5")
+    return {"question": question, "answer": answer, "category": category, "difficulty": difficulty}
+
+
+def insert_batch(batch):
+    '''
+    insert_batch(batch)
+        inserts [(line number, row)] in one statement and one commit. If the database rejects the batch,
+        rows are retried one by one in savepoints so only the failing rows are lost.
+        Returns (inserted count, [(line number, error)]).
+    '''
+    table = Question.__table__
+    try:
+        db.session.execute(table.insert(), [row for _, row in batch])
+        db.session.commit()
+        return len(batch), []
+    except Exception:
+        db.session.rollback()
+
+    inserted, errors = 0, []
+    for line_number, row in batch:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), row)
+            inserted += 1
+        except Exception as error:
+            errors.append((line_number, str(getattr(error, "orig", error)).strip()))
+    db.session.commit()
+    return inserted, errors
+
+
+def import_questions(lines, format, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    import_questions(lines, format, batch_size)
+        imports questions from an iterable of text lines and returns
+        {"inserted": <count>, "failed": <count>, "errors": [{"line": <number>, "error": <message>}]}.
+    '''
+    category_ids = {id for id, in db.session.query(Category.id)}
+    inserted, failed, errors = 0, 0, []
+
+    def report(line_number, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": line_number, "error": error})
+
+    batch = []
+    for line_number, row, error in read_rows(lines, format):
+        if error is None:
+            try:
+                batch.append((line_number, validate(row, category_ids)))
+            except ValueError as invalid:
+                error = str(invalid)
+        if error is not None:
+            report(line_number, error)
+
+        if len(batch) >= batch_size:
+            count, batch_errors = insert_batch(batch)
+            inserted += count
+            for line_number, error in batch_errors:
+                report(line_number, error)
+            batch = []
+
+    if batch:
+        count, batch_errors = insert_batch(batch)
+        inserted += count
+        for line_number, error in batch_errors:
+            report(line_number, error)
+
+    if inserted:
+        # rows were inserted behind the ORM, in-memory indexes rebuild lazily
+        notify_question_listeners("reload", None)
+
+    return {"inserted": inserted, "failed": failed, "errors": errors}
+
+
+def export_questions(format, batch_size=EXPORT_BATCH_SIZE):
+    '''
+    export_questions(format, batch_size)
+        yields the whole question bank as NDJSON lines or CSV rows, ordered by id.
+    '''
+    columns = [getattr(Question, field) for field in FIELDS]
+    rows = db.session.query(Question.id, *columns) \
+        .order_by(Question.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(batch_size)
+
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(("id",) + FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    for row in rows:
+        yield json.dumps(dict(zip(("id",) + FIELDS, row))) + "\n"
+
+
+def is_question_id(value):
+    # JSON booleans decode to bool, which is an int too
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def apply_batch(deletes, inserts, updates):
+    '''
+    apply_batch(deletes, inserts, updates)
+        deletes the ids in deletes, inserts the question dicts in inserts and applies the
+        {"id": <id>, <field>: <value>} changes in updates in one transaction: one SELECT of the affected rows,
+        one DELETE ... WHERE id IN (...), one executemany UPDATE and one multi row INSERT.
+        Missing and invalid items are skipped.
+        Returns {"delete": [...], "insert": [...], "update": [...]} with a result per item, in request order.
+    '''
+    table = Question.__table__
+    category_ids = {id for id, in db.session.query(Category.id)}
+    existing = {}
+    ids = set(deletes) | {item.get("id") for item in updates}
+    if ids:
+        columns = [table.c.id] + [table.c[field] for field in FIELDS]
+        rows = db.session.execute(select(*columns).where(table.c.id.in_(ids)))
+        existing = {row.id: dict(row._mapping) for row in rows}
+
+    results = {"delete": [], "insert": [], "update": []}
+    deleted = dict.fromkeys(id for id in deletes if id in existing)
+    reported = set()
+    for id in deletes:
+        status = "duplicate" if id in reported else "deleted" if id in existing else "not_found"
+        reported.add(id)
+        results["delete"].append({"id": id, "status": status})
+
+    updated = {}
+    for item in updates:
+        id = item.get("id")
+        if id not in existing or id in deleted:
+            results["update"].append({"id": id, "status": "not_found"})
+            continue
+        try:
+            row = validate({**existing[id], **updated.get(id, {}), **item}, category_ids)
+        except ValueError as error:
+            results["update"].append({"id": id, "status": "invalid", "error": str(error)})
+            continue
+        updated[id] = row
+        results["update"].append({"id": id, "status": "updated"})
+
+    valid = []
+    for index, item in enumerate(inserts):
+        try:
+            valid.append((index, validate(item, category_ids)))
+        except ValueError as error:
+            results["insert"].append({"index": index, "status": "invalid", "error": str(error)})
+
+    if deleted:
+        db.session.execute(table.delete().where(table.c.id.in_(list(deleted))))
+    if updated:
+        db.session.execute(table.update().where(table.c.id == bindparam("question_id")),
+                           [{"question_id": id, **row} for id, row in updated.items()])
+    inserted_ids = []
+    if valid and db.engine.dialect.name == "postgresql":
+        inserted_ids = [id for id, in db.session.execute(
+            table.insert().values([row for _, row in valid]).returning(table.c.id))]
+    elif valid:
+        # no RETURNING for multi row inserts on this dialect
+        inserted_ids = [db.session.execute(table.insert(), row).inserted_primary_key[0] for _, row in valid]
+    db.session.commit()
+
+    for (index, row), id in zip(valid, inserted_ids):
+        results["insert"].append({"index": index, "status": "inserted", "id": id})
+        notify_question_listeners("insert", {"id": id, **row})
+    results["insert"].sort(key=lambda result: result["index"])
+    for id in deleted:
+        notify_question_listeners("delete", existing[id])
+    for id, row in updated.items():
+        notify_question_listeners("update", {"id": id, **row})
+
+    return results
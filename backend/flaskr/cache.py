@@ -0,0 +1,210 @@
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE_TTL = 60
+MAX_ENTRIES = 10000
+MAX_ROWS = 1000
+EVERYTHING = "*"
+ALL_QUESTIONS = "all"
+
+'''
+Cache of the question listings behind GET /questions, GET /categories/<id>/questions
+and POST /questions/search.
+
+A key is the route, its normalized arguments and the generation counters of the scopes
+the result depends on: "all" for listings across categories, "category:<id>" for one
+category, and "*" for everything. Question writes bump the counters of the scopes they
+touch, so a new question in category 3 retires the /questions pages, search results and
+category 3 pages but keeps the pages of every other category. Updates, bulk imports and
+category deletes do not tell which categories they touched and bump "*".
+Retired entries are never read again and age out through the LRU bound and the ttl.
+
+Only the questions and their cursors are cached. Totals and categories are cheap in-memory
+reads and are added to every response fresh.
+'''
+
+
+class MemoryCache:
+    '''
+    MemoryCache(max_entries, ttl)
+        an in-process LRU with a per entry ttl.
+    '''
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def counters_of(self, names):
+        with self.lock:
+            return [self.counters.get(name, 0) for name in names]
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    '''
+    RedisCache(url, ttl)
+        keeps entries and generation counters in a Redis compatible server shared by every worker,
+        so a write in one worker retires the entries of all of them. Redis enforces the size bound
+        through its maxmemory policy.
+    '''
+
+    PREFIX = "trivia:cache:"
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.PREFIX + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.PREFIX + key, json.dumps(value), ex=self.ttl)
+
+    def counters_of(self, names):
+        return [int(value or 0) for value in self.client.mget([self.PREFIX + "gen:" + name for name in names])]
+
+    def incr(self, name):
+        self.client.incr(self.PREFIX + "gen:" + name)
+
+    def __len__(self):
+        return 0
+
+
+class ResponseCache:
+    '''
+    ResponseCache(backend, max_rows, bypass)
+        caches question listings keyed by route, arguments and scope generations.
+        Listings longer than max_rows are streamed without being cached, and so are the
+        listings of requests for which bypass() is true.
+    '''
+
+    def __init__(self, backend, max_rows=MAX_ROWS, bypass=None):
+        self.backend = backend
+        self.max_rows = max_rows
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        # requests of a threaded server count concurrently
+        self.lock = threading.Lock()
+
+    def key(self, route, args, scopes):
+        names = (EVERYTHING,) + tuple(scopes)
+        generations = ",".join(f"{name}={generation}"
+                               for name, generation in zip(names, self.backend.counters_of(names)))
+        arguments = "&".join(f"{name}={value}" for name, value in sorted(args.items()) if value is not None)
+        return f"{route}?{arguments}#{generations}"
+
+    def listing(self, route, args, scopes, load):
+        '''
+        listing(route, args, scopes, load)
+            returns (questions, fields) from the cache, or from load() which returns
+            (an iterable of question dicts, a dict of extra response fields) on a miss.
+        '''
+        if self.bypass is not None and self.bypass():
+            return load()
+        key = self.key(route, args, scopes)
+        cached = self.backend.get(key)
+        if cached is not None:
+            with self.lock:
+                self.hits += 1
+            return cached["questions"], cached["fields"]
+
+        with self.lock:
+            self.misses += 1
+        questions, fields = load()
+        questions = iter(questions)
+        head = list(itertools.islice(questions, self.max_rows + 1))
+        if len(head) > self.max_rows:
+            return itertools.chain(head, questions), fields
+        self.backend.set(key, {"questions": head, "fields": fields})
+        return head, fields
+
+    def on_question_change(self, action, question):
+        if action in ("insert", "delete"):
+            self.backend.incr(ALL_QUESTIONS)
+            if question["category"] is not None:
+                self.backend.incr(f"category:{question['category']}")
+        else:
+            # the previous category of an update and the rows of a bulk write are unknown
+            self.backend.incr(EVERYTHING)
+
+    def on_category_change(self, action, category):
+        if action == "delete":
+            # the foreign key moved its questions out of the category
+            self.backend.incr(EVERYTHING)
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        requests = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / requests, 4) if requests else 0.0,
+            "entries": len(self.backend)
+        }
+
+
+class NoCache(ResponseCache):
+    def __init__(self):
+        super().__init__(None)
+
+    def listing(self, route, args, scopes, load):
+        return load()
+
+    def on_question_change(self, action, question):
+        pass
+
+    def on_category_change(self, action, category):
+        pass
+
+    def stats(self):
+        return {"hits": 0, "misses": 0, "hit_ratio": 0.0, "entries": 0}
+
+
+def create_response_cache(uri, ttl=RESPONSE_CACHE_TTL, max_entries=MAX_ENTRIES, bypass=None):
+    '''
+    create_response_cache(uri)
+        builds a cache from the RESPONSE_CACHE setting: "memory", "none" or "redis://<host>:<port>/<db>".
+    '''
+    if uri == "none":
+        return NoCache()
+    if uri == "memory":
+        return ResponseCache(MemoryCache(max_entries, ttl), bypass=bypass)
+    if uri.startswith(("redis://", "rediss://", "unix://")):
+        return ResponseCache(RedisCache(uri, ttl), bypass=bypass)
+    raise ValueError(f"Unsupported response cache: {uri}")
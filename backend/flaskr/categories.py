@@ -0,0 +1,55 @@
+import hashlib
+import threading
+import time
+
+from flask import json
+
+from models import Category
+
+CATEGORY_CACHE_TTL = 5 * 60
+
+
+class CategoryCache:
+    '''
+    CategoryCache(ttl)
+        keeps the serialized category map in process. Category writes bump the version,
+        which drops the cached map; the ttl bounds how stale it gets after writes
+        made by other processes.
+        The ETag is a hash of the serialized map, so every worker hands out the same one.
+    '''
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self.entry = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, *args):
+        with self.lock:
+            self.version += 1
+            self.entry = None
+
+    def load(self):
+        with self.lock:
+            version = self.version
+
+        categories = {c.id: c.type for c in Category.query.order_by(Category.id).all()}
+        body = json.dumps({"success": True, "categories": categories})
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        entry = (version, time.monotonic(), categories, body, etag)
+
+        with self.lock:
+            # a write while loading makes the entry stale, serve it once but do not keep it
+            if version == self.version:
+                self.entry = entry
+        return entry
+
+    def get(self):
+        '''
+        get()
+            returns (categories, body, etag) where body is the serialized GET /categories response.
+        '''
+        entry = self.entry
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            entry = self.load()
+        return entry[2:]
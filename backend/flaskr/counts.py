@@ -0,0 +1,76 @@
+import threading
+import time
+
+from sqlalchemy import func, text
+
+from models import db, Question
+
+RECONCILE_INTERVAL = 5 * 60
+
+
+class QuestionCounts:
+    '''
+    QuestionCounts(mode, reconcile_interval)
+        global and per category question counts, kept up to date by question listeners
+        and reconciled with a single grouped COUNT every reconcile_interval seconds.
+        In "estimated" mode the global count comes from pg_class.reltuples on Postgres,
+        which is a catalog lookup instead of a table scan.
+    '''
+
+    def __init__(self, mode="exact", reconcile_interval=RECONCILE_INTERVAL):
+        self.mode = mode
+        self.reconcile_interval = reconcile_interval
+        self.by_category = None
+        self.reconciled_at = None
+        self.lock = threading.Lock()
+
+    def reconcile(self):
+        rows = db.session.query(Question.category, func.count(Question.id)).group_by(Question.category).all()
+        by_category = {}
+        for category, count in rows:
+            category = int(category) if category is not None else None
+            by_category[category] = by_category.get(category, 0) + count
+
+        with self.lock:
+            self.by_category = by_category
+            self.reconciled_at = time.monotonic()
+        return by_category
+
+    def ensure_reconciled(self):
+        by_category = self.by_category
+        if by_category is None or time.monotonic() - self.reconciled_at > self.reconcile_interval:
+            by_category = self.reconcile()
+        return by_category
+
+    def on_question_change(self, action, question):
+        if self.by_category is None:
+            return
+        if action in ("update", "reload"):
+            # the previous category is unknown, recount on next read
+            with self.lock:
+                self.by_category = None
+            return
+
+        category = int(question["category"]) if question["category"] is not None else None
+        with self.lock:
+            if self.by_category is not None:
+                delta = 1 if action == "insert" else -1
+                self.by_category[category] = max(self.by_category.get(category, 0) + delta, 0)
+
+    def estimated_total(self):
+        if db.engine.dialect.name != "postgresql":
+            return None
+        estimate = db.session.execute(text("SELECT reltuples::bigint FROM pg_class "
+                                           "WHERE oid = 'public.questions'::regclass")).scalar()
+        # -1 or 0 until the table has been vacuumed or analyzed
+        return estimate if estimate and estimate > 0 else None
+
+    def total(self):
+        if self.mode == "estimated":
+            estimate = self.estimated_total()
+            if estimate is not None:
+                return estimate
+        return sum(self.ensure_reconciled().values())
+
+    def in_category(self, category):
+        return self.ensure_reconciled().get(int(category), 0)
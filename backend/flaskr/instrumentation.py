@@ -0,0 +1,229 @@
+import cProfile
+import heapq
+import os
+import random
+import re
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import pool_metrics
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+'''
+Opt-in per request instrumentation, enabled with INSTRUMENTATION=True.
+
+Every request records its latency, the number and duration of its SQL statements
+(through SQLAlchemy engine events) and the time spent encoding JSON. They are sent back
+in a Server-Timing header and aggregated into histograms served by GET /metrics
+in the Prometheus text format. Streamed responses are recorded once their body is sent;
+their Server-Timing header, sent first, only covers the time until the headers.
+With PROFILE_SAMPLE_RATE > 0 a share of requests runs under cProfile and the slowest
+PROFILE_KEEP profiles are kept as .prof files in PROFILE_DIR.
+'''
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def samples(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics:
+    '''
+    Metrics
+        request, SQL and serialization histograms per (method, route).
+    '''
+
+    HISTOGRAMS = (
+        ("trivia_request_duration_seconds", "Request latency."),
+        ("trivia_sql_duration_seconds", "Time spent in SQL statements per request."),
+        ("trivia_serialization_duration_seconds", "Time spent encoding JSON per request.")
+    )
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.histograms = {name: {} for name, _ in self.HISTOGRAMS}
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, route, duration, sql_duration, statements, serialization_duration):
+        key = (method, route)
+        with self.lock:
+            for name, value in zip((name for name, _ in self.HISTOGRAMS),
+                                   (duration, sql_duration, serialization_duration)):
+                self.histograms[name].setdefault(key, Histogram()).observe(value)
+            self.statements[key] = self.statements.get(key, 0) + statements
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, description in self.HISTOGRAMS:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+                for (method, route), histogram in sorted(self.histograms[name].items()):
+                    lines += histogram.samples(name, f'method="{method}",route="{route}"')
+
+            lines += ["# HELP trivia_sql_statements_total SQL statements executed.",
+                      "# TYPE trivia_sql_statements_total counter"]
+            for (method, route), count in sorted(self.statements.items()):
+                lines.append(f'trivia_sql_statements_total{{method="{method}",route="{route}"}} {count}')
+
+        for name, value in pool_metrics().items():
+            if isinstance(value, (int, float)):
+                lines += [f"# TYPE trivia_db_pool_{name} gauge", f"trivia_db_pool_{name} {value}"]
+        if self.cache is not None:
+            for name, value in self.cache.stats().items():
+                lines += [f"# TYPE trivia_response_cache_{name} gauge", f"trivia_response_cache_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    '''
+    Profiler(directory, sample_rate, keep)
+        profiles a random share of requests and keeps the keep slowest on disk.
+    '''
+
+    def __init__(self, directory, sample_rate, keep):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.slowest = []
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, method, route, duration):
+        profile.disable()
+        with self.lock:
+            if len(self.slowest) >= self.keep and duration <= self.slowest[0][0]:
+                return
+            slug = re.sub(r"[^\w.-]+", "_", route.strip("/")) or "root"
+            name = f"{duration * 1000:010.3f}ms-{method}-{slug}-{time.time_ns()}.prof"
+            path = os.path.join(self.directory, name)
+            profile.dump_stats(path)
+            heapq.heappush(self.slowest, (duration, path))
+            if len(self.slowest) > self.keep:
+                _, fastest = heapq.heappop(self.slowest)
+                os.remove(fastest)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "timings" in g:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if has_app_context() and "timings" in g and starts:
+        g.timings["sql"] += time.perf_counter() - starts.pop()
+        g.timings["statements"] += 1
+
+
+def time_serialization(dumps):
+    def timed_dumps(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return dumps(*args, **kwargs)
+        finally:
+            if has_app_context() and "timings" in g:
+                g.timings["serialization"] += time.perf_counter() - start
+    return timed_dumps
+
+
+def instrument_json(app):
+    if hasattr(app, "json_provider_class"):
+        app.json.dumps = time_serialization(app.json.dumps)
+        return
+
+    class TimedJSONEncoder(app.json_encoder):
+        encode = time_serialization(app.json_encoder.encode)
+
+    app.json_encoder = TimedJSONEncoder
+
+
+def server_timing(timings, duration, name="total"):
+    return ", ".join((
+        f'db;dur={timings["sql"] * 1000:.3f};desc="{timings["statements"]} statements"',
+        f'serialize;dur={timings["serialization"] * 1000:.3f}',
+        f'{name};dur={duration * 1000:.3f}'
+    ))
+
+
+def init_instrumentation(app):
+    '''
+    init_instrumentation(app)
+        installs the timing hooks and the GET /metrics endpoint on the app.
+    '''
+    metrics = Metrics(app.extensions.get("response_cache"))
+    profiler = None
+    if app.config["PROFILE_SAMPLE_RATE"] > 0:
+        profiler = Profiler(app.config["PROFILE_DIR"], app.config["PROFILE_SAMPLE_RATE"], app.config["PROFILE_KEEP"])
+
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    instrument_json(app)
+
+    @app.before_request
+    def start_timing():
+        g.timings = {"start": time.perf_counter(), "sql": 0.0, "statements": 0, "serialization": 0.0}
+        g.profile = profiler.start() if profiler else None
+
+    @app.after_request
+    def record_timing(response):
+        timings = g.get("timings")
+        if timings is None:
+            return response
+        method = request.method
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        profile = g.pop("profile", None)
+
+        def finish():
+            duration = time.perf_counter() - timings["start"]
+            if profile is not None:
+                profiler.finish(profile, method, route, duration)
+            metrics.record(method, route, duration, timings["sql"], timings["statements"], timings["serialization"])
+            return duration
+
+        if response.is_streamed:
+            # the body runs its queries and encodes its JSON after this hook, while the server iterates it,
+            # so the request is recorded when the response is closed. The header can only time the head.
+            response.call_on_close(finish)
+            response.headers.add("Server-Timing", server_timing(timings, time.perf_counter() - timings["start"],
+                                                                "headers"))
+        else:
+            del g.timings
+            response.headers.add("Server-Timing", server_timing(timings, finish()))
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    return metrics
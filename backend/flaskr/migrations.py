@@ -0,0 +1,70 @@
+import os
+import re
+
+from sqlalchemy import text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4}_\w+?)(?:\.(\w+))?\.sql$")
+
+'''
+Schema migrations are SQL files in the migrations folder, applied in order on top of trivia.psql.
+
+`NNNN_name.sql` runs on every database, `NNNN_name.<dialect>.sql` only on that dialect
+(postgresql, sqlite). Applied versions are recorded in the schema_migrations table.
+On Postgres every migration runs in its own transaction, so a failing one leaves no trace.
+'''
+
+
+def available_migrations(dialect, directory=MIGRATIONS_DIR):
+    '''
+    available_migrations(dialect)
+        returns [(version, path)] of the migrations that apply to the dialect, in order.
+    '''
+    migrations = {}
+    for name in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(name)
+        if not match:
+            continue
+        version, target = match.groups()
+        if target is None:
+            migrations.setdefault(version, os.path.join(directory, name))
+        elif target == dialect:
+            migrations[version] = os.path.join(directory, name)
+    return sorted(migrations.items())
+
+
+def applied_migrations(connection):
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations "
+                            "(version VARCHAR(255) PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"))
+    return {version for version, in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_script(connection, sql):
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.name == "sqlite":
+            cursor.executescript(sql)
+        else:
+            cursor.execute(sql)
+    finally:
+        cursor.close()
+
+
+def migrate(engine, directory=MIGRATIONS_DIR):
+    '''
+    migrate(engine)
+        applies the pending migrations and returns their versions.
+    '''
+    with engine.begin() as connection:
+        applied = applied_migrations(connection)
+
+    pending = [(version, path) for version, path in available_migrations(engine.dialect.name, directory)
+               if version not in applied]
+    for version, path in pending:
+        with open(path, encoding="utf-8") as file:
+            sql = file.read()
+        with engine.begin() as connection:
+            run_script(connection, sql)
+            connection.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                               {"version": version})
+    return [version for version, _ in pending]
@@ -0,0 +1,140 @@
+import zlib
+
+from flask import json, request
+
+from .reads import FIELDS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.trivia.columnar+json"
+MSGPACK = "application/msgpack"
+COMPRESSIBLE = (JSON, COLUMNAR_JSON, MSGPACK, "application/x-ndjson", "text/csv", "text/plain")
+
+'''
+Content negotiation for every route.
+
+Accept chooses the encoding of question lists. JSON stays the default, while
+application/vnd.trivia.columnar+json and application/msgpack (with the msgpack package)
+send {"fields": [...], "rows": [[...], ...]} so the field names appear once per response
+instead of once per question. Other responses keep their shape and are only re-encoded
+as MessagePack when it is asked for.
+
+Accept-Encoding chooses the compression: br (with the brotli package) or gzip, for responses
+of at least COMPRESSION_MIN_SIZE bytes. Streamed responses are compressed chunk by chunk
+as they are produced.
+'''
+
+
+def response_format():
+    '''
+    response_format()
+        returns the mimetype the client prefers among JSON, columnar JSON and MessagePack.
+    '''
+    offers = [JSON, COLUMNAR_JSON] + ([MSGPACK] if msgpack is not None else [])
+    return request.accept_mimetypes.best_match(offers, default=JSON)
+
+
+def representation_etag(etag):
+    '''
+    representation_etag(etag)
+        returns the ETag of the JSON body of a response for the encoding the client asked for,
+        so a validator of one encoding never matches a request for the other.
+    '''
+    return f"{etag}-msgpack" if response_format() == MSGPACK else etag
+
+
+def string_keys(data):
+    # JSON turns object keys into strings, and msgpack.unpackb rejects integer keys by default
+    if isinstance(data, dict):
+        return {key if isinstance(key, str) else json.dumps(key): string_keys(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [string_keys(value) for value in data]
+    return data
+
+
+def columnar(questions, fields=FIELDS):
+    return {"fields": list(fields), "rows": [[question[field] for field in fields] for question in questions]}
+
+
+def encode(data, mimetype):
+    if mimetype == MSGPACK:
+        return msgpack.packb(string_keys(data), use_bin_type=True)
+    return json.dumps(data).encode() + b"\n"
+
+
+def compressor(encoding, level):
+    if encoding == "br":
+        compress = brotli.Compressor(quality=min(level, 11))
+        return compress.process, compress.finish
+    compress = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compress.compress, compress.flush
+
+
+def compress_chunks(chunks, encoding, level, close=None):
+    process, finish = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            compressed = process(chunk)
+            if compressed:
+                yield compressed
+        yield finish()
+    finally:
+        # the server closes this generator, pass it on to the wrapped one
+        if close is not None:
+            close()
+
+
+def compress_response(response, min_size=COMPRESSION_MIN_SIZE, level=COMPRESSION_LEVEL):
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or response.status_code in (204, 206, 304) or response.status_code < 200 \
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE:
+        return response
+
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if brotli is not None else ["gzip"])
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        source = response.response
+        response.response = compress_chunks(response.iter_encoded(), encoding, level, getattr(source, "close", None))
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        process, finish = compressor(encoding, level)
+        response.set_data(process(data) + finish())
+
+    response.headers["Content-Encoding"] = encoding
+    if response.headers.get("ETag", "").startswith('"'):
+        # the compressed bytes differ, a weak ETag still matches If-None-Match
+        response.headers["ETag"] = "W/" + response.headers["ETag"]
+    return response
+
+
+def init_negotiation(app):
+    '''
+    init_negotiation(app)
+        re-encodes JSON responses as MessagePack when asked for and compresses responses.
+    '''
+    @app.after_request
+    def negotiate(response):
+        if response.mimetype == JSON:
+            response.vary.add("Accept")
+            if not response.is_streamed and response.status_code != 304 and response_format() == MSGPACK:
+                response.set_data(encode(json.loads(response.get_data()), MSGPACK))
+                response.mimetype = MSGPACK
+        if app.config["COMPRESSION"]:
+            return compress_response(response, app.config["COMPRESSION_MIN_SIZE"], app.config["COMPRESSION_LEVEL"])
+        return response
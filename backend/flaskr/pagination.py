@@ -0,0 +1,65 @@
+import base64
+import binascii
+
+from sqlalchemy import tuple_
+
+from models import Question
+
+'''
+Questions are paginated on the stable (difficulty, id) key.
+
+A cursor is the opaque, url safe encoding of the key of the last question on a page.
+Passing it back as `?after=<cursor>` seeks straight to the next page through the
+index instead of scanning and discarding every row before it.
+'''
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values):
+    raw = ",".join(str(value) for value in values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size=2):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = tuple(int(value) for value in base64.urlsafe_b64decode(padded.encode()).decode().split(","))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if len(values) != size:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def paginate_query(query, per_page, page=1, after=None):
+    '''
+    paginate_query(query, per_page, page, after)
+        orders the query by (difficulty, id) and limits it to one page plus one row,
+        which tells whether a next page exists without a COUNT.
+        `after` takes precedence over `page`.
+    '''
+    query = query.order_by(Question.difficulty, Question.id)
+    if after is not None:
+        query = query.filter(tuple_(Question.difficulty, Question.id) > decode_cursor(after))
+    else:
+        query = query.offset((page - 1) * per_page)
+    return query.limit(per_page + 1)
+
+
+def paginate(query, per_page, page=1, after=None):
+    '''
+    paginate(query, per_page, page, after)
+        returns a page of questions or question rows ordered by (difficulty, id) and the cursor of the next page.
+        The cursor is None when there are no more questions.
+    '''
+    questions = paginate_query(query, per_page, page, after).all()
+    next_cursor = None
+    if len(questions) > per_page:
+        questions = questions[:per_page]
+        last = questions[-1]
+        next_cursor = encode_cursor(last.difficulty, last.id)
+
+    return questions, next_cursor
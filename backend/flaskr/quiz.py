@@ -0,0 +1,389 @@
+import random
+import threading
+import time
+
+from models import db, Question
+from .reads import get_question
+from .replicas import on_replica
+
+ALL_CATEGORIES = 0
+QUIZ_INDEX_TTL = 60
+SAMPLE_ATTEMPTS = 32
+ORDERS = ("deck", "random")
+STRATEGIES = ("random", "adaptive")
+START_DIFFICULTY = 1
+ADAPTIVE_WINDOW = 4
+
+
+class IdPool:
+    '''
+    IdPool
+        a set of question ids with O(1) add, remove and uniform random sampling.
+        ids live in a list for sampling, positions maps an id to its slot for swap-removal.
+    '''
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def add(self, id):
+        if id in self.positions:
+            return
+        self.positions[id] = len(self.ids)
+        self.ids.append(id)
+
+    def remove(self, id):
+        position = self.positions.pop(id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def sample(self, excluded, rng=random, attempts=SAMPLE_ATTEMPTS):
+        '''
+        sample(excluded)
+            returns a random id that is not in the excluded set, or None if every id is excluded.
+        '''
+        ids = self.ids
+        if not ids:
+            return None
+
+        seen = sum(1 for id in excluded if id in self.positions)
+        # sample and reject is O(1) expected while at most half of the pool has been seen
+        if seen * 2 <= len(ids):
+            for _ in range(attempts):
+                id = ids[rng.randrange(len(ids))]
+                if id not in excluded:
+                    return id
+
+        remaining = [id for id in ids if id not in excluded]
+        return rng.choice(remaining) if remaining else None
+
+    def pick(self, previous_questions, excluded, rng=random):
+        return self.sample(excluded, rng)
+
+
+class Deck:
+    '''
+    Deck(rng)
+        a shuffled permutation of question ids. A quiz walks it from a random slot, so the next
+        question is found in O(1) without drawing random numbers.
+        A new id swaps places with a random slot, which keeps the order a uniform shuffle.
+        A removed id leaves a tombstone (None) until more than half of the slots are dead
+        and the deck is compacted, which keeps the order of the live ids.
+    '''
+
+    def __init__(self, rng=random):
+        self.rng = rng
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def add(self, id):
+        if id in self.positions:
+            return
+        position = self.rng.randrange(len(self.ids) + 1)
+        self.ids.append(id)
+        if position < len(self.ids) - 1:
+            moved = self.ids[position]
+            self.ids[-1] = moved
+            if moved is not None:
+                self.positions[moved] = len(self.ids) - 1
+            self.ids[position] = id
+        self.positions[id] = position
+
+    def remove(self, id):
+        position = self.positions.pop(id, None)
+        if position is None:
+            return
+        self.ids[position] = None
+        if len(self.positions) * 2 < len(self.ids):
+            self.compact()
+
+    def compact(self):
+        self.ids = [id for id in self.ids if id is not None]
+        self.positions = {id: position for position, id in enumerate(self.ids)}
+
+    def pick(self, previous_questions, excluded, rng=random):
+        '''
+        pick(previous_questions, excluded)
+            returns the id that follows the previous questions in the deck, or None if every id is excluded.
+            The walk resumes len(previous_questions) slots after the first question of the quiz,
+            a quiz without previous questions starts at a random slot.
+        '''
+        if not self.positions:
+            return None
+        size = len(self.ids)
+        start = self.positions.get(previous_questions[0]) if previous_questions else None
+        position = rng.randrange(size) if start is None else start + len(previous_questions)
+        for step in range(size):
+            id = self.ids[(position + step) % size]
+            if id is not None and id not in excluded:
+                return id
+        return None
+
+
+class QuizIndex:
+    '''
+    QuizIndex(ttl, rng, order, store)
+        per category pools of question ids used to pick the next quiz question
+        without loading the category. Category 0 holds every question.
+        With order "deck" a pool is a Deck walked in a shuffled order, with "random" an IdPool
+        sampled independently for every question. Pass a seeded rng for a reproducible order.
+        Every category also keeps an IdPool per difficulty, so a question of a target difficulty,
+        or of the nearest one, is sampled in O(1) expected time.
+        It is loaded lazily, from the database or the snapshot of a SnapshotStore, kept in sync by
+        question listeners and reloaded in the background every ttl seconds to pick up writes made by
+        other processes.
+    '''
+
+    def __init__(self, ttl=QUIZ_INDEX_TTL, rng=None, order="deck", store=None):
+        if order not in ORDERS:
+            raise ValueError(f"Unsupported quiz order: {order}")
+        self.ttl = ttl
+        self.order = order
+        self.store = store
+        self.rng = rng or random.Random()
+        self.pools = {}
+        self.buckets = {}
+        self.categories = {}
+        self.difficulties = {}
+        self.loaded_at = None
+        self.changes = None
+        # reentrant, as changes replayed by load() add and remove under it
+        self.lock = threading.RLock()
+        self.load_lock = threading.Lock()
+
+    def new_pool(self):
+        return Deck(self.rng) if self.order == "deck" else IdPool()
+
+    def load(self):
+        with self.lock:
+            self.changes = []
+        pools = {ALL_CATEGORIES: self.new_pool()}
+        buckets = {ALL_CATEGORIES: {}}
+        categories = {}
+        difficulties = {}
+        # a stable row order makes a seeded shuffle reproducible
+        try:
+            if self.store is not None:
+                rows = self.store.current().quiz_rows()
+            else:
+                rows = db.session.query(Question.id, Question.category, Question.difficulty) \
+                    .order_by(Question.id).yield_per(10000)
+            for id, category, difficulty in rows:
+                category = int(category) if category is not None else None
+                categories[id] = category
+                difficulties[id] = difficulty
+                for key in (ALL_CATEGORIES, category) if category is not None else (ALL_CATEGORIES,):
+                    if key not in pools:
+                        pools[key] = self.new_pool()
+                        buckets[key] = {}
+                    pools[key].add(id)
+                    if difficulty is not None:
+                        buckets[key].setdefault(difficulty, IdPool()).add(id)
+        except Exception:
+            self.changes = None
+            raise
+
+        with self.lock:
+            self.pools = pools
+            self.buckets = buckets
+            self.categories = categories
+            self.difficulties = difficulties
+            self.loaded_at = time.monotonic()
+            # writes committed while the table was read may be missing from it
+            for action, question in self.changes:
+                self.apply(action, question)
+            self.changes = None
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            # nothing to pick from yet, the first request loads and the others wait for it
+            with self.load_lock:
+                if self.loaded_at is None:
+                    self.load()
+        elif self.is_stale():
+            self.refresh()
+
+    def refresh(self):
+        '''
+        refresh()
+            reloads the index in a background thread unless a reload is already running.
+            Requests keep picking from the current pools until the new ones are swapped in.
+        '''
+        if not self.load_lock.acquire(blocking=False):
+            return
+        try:
+            app = db.get_app()
+            threading.Thread(target=self.reload, args=(app,), name="quiz-index-reload", daemon=True).start()
+        except Exception:
+            self.load_lock.release()
+            raise
+
+    def reload(self, app):
+        try:
+            with app.app_context():
+                self.load()
+        except Exception:
+            # keep the current pools, the next request after the ttl tries again
+            if self.loaded_at is not None:
+                self.loaded_at = time.monotonic()
+            app.logger.exception("Quiz index reload failed")
+        finally:
+            self.load_lock.release()
+
+    def add(self, id, category, difficulty=None):
+        category = int(category) if category is not None else None
+        with self.lock:
+            self.categories[id] = category
+            self.difficulties[id] = difficulty
+            for key in (ALL_CATEGORIES, category) if category is not None else (ALL_CATEGORIES,):
+                if key not in self.pools:
+                    self.pools[key] = self.new_pool()
+                    self.buckets[key] = {}
+                self.pools[key].add(id)
+                if difficulty is not None:
+                    self.buckets[key].setdefault(difficulty, IdPool()).add(id)
+
+    def remove(self, id):
+        with self.lock:
+            category = self.categories.pop(id, None)
+            difficulty = self.difficulties.pop(id, None)
+            for key in (ALL_CATEGORIES, category):
+                if key in self.pools:
+                    self.pools[key].remove(id)
+                if difficulty in self.buckets.get(key, {}):
+                    self.buckets[key][difficulty].remove(id)
+
+    def on_question_change(self, action, question):
+        with self.lock:
+            if self.changes is not None:
+                self.changes.append((action, question))
+            if self.loaded_at is not None:
+                self.apply(action, question)
+
+    def apply(self, action, question):
+        if action == "reload":
+            self.loaded_at = None
+            return
+        self.remove(question["id"])
+        if action != "delete":
+            self.add(question["id"], question["category"], question["difficulty"])
+
+    def count(self, category):
+        self.ensure_loaded()
+        return len(self.pools.get(category, ()))
+
+    def pick(self, category, previous_questions, excluded, difficulty=None):
+        self.ensure_loaded()
+        if difficulty is not None:
+            return self.pick_nearest(category, difficulty, excluded)
+        # a pool's lists are swapped and shrunk by writes, so it is read under the lock
+        with self.lock:
+            pool = self.pools.get(category)
+            if pool is None:
+                return None
+            return pool.pick(previous_questions, excluded, self.rng)
+
+    def pick_nearest(self, category, difficulty, excluded):
+        '''
+        pick_nearest(category, difficulty, excluded)
+            returns a random id of the category with the given difficulty, or with the nearest difficulty
+            that has an id left, the easier one on a tie. None if every id is excluded.
+        '''
+        with self.lock:
+            buckets = self.buckets.get(category, {})
+            for level in sorted(buckets, key=lambda level: (abs(level - difficulty), level)):
+                id = buckets[level].sample(excluded, self.rng)
+                if id is not None:
+                    return id
+            return None
+
+    def target_difficulty(self, strategy, difficulty, previous_questions, answers):
+        '''
+        target_difficulty(strategy, difficulty, previous_questions, answers)
+            with the "random" strategy returns the requested difficulty, or None for any difficulty.
+            With "adaptive" starts at the requested difficulty and follows the answers to the previous questions.
+        '''
+        if strategy == "random":
+            return difficulty
+        self.ensure_loaded()
+        asked = [self.difficulties.get(id) for id in previous_questions]
+        return adapt_difficulty([level for level in asked if level is not None], answers,
+                                difficulty if difficulty is not None else START_DIFFICULTY)
+
+    def next_question(self, category, previous_questions, difficulty=None, excluded=None):
+        '''
+        next_question(category, previous_questions, difficulty, excluded)
+            returns the format() dict of a random question of the category that is not in previous_questions,
+            of the difficulty nearest to the given one if any, or None when all of them have been asked.
+            Pass excluded, the set of the previous questions, when the caller already keeps one.
+        '''
+        if excluded is None:
+            excluded = set(previous_questions)
+        while True:
+            id = self.pick(category, previous_questions, excluded, difficulty)
+            if id is None:
+                return None
+            question = self.store.current().get(id) if self.store is not None else get_question(id)
+            if question is None and self.store is None and on_replica():
+                # a lagging replica misses the questions just committed on the primary
+                question = get_question(id, primary=True)
+            if question is not None:
+                return question
+            # deleted by another process since the index was loaded
+            self.remove(id)
+
+
+def quiz_strategy(data):
+    '''
+    quiz_strategy(data)
+        reads the optional "strategy", "difficulty" and "previous_answers" of a quiz request.
+        Raises ValueError for invalid values.
+    '''
+    strategy = data.get("strategy", "random")
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unsupported quiz strategy: {strategy}")
+    difficulty = data.get("difficulty")
+    difficulty = int(difficulty) if difficulty is not None else None
+    answers = data.get("previous_answers", [])
+    if not isinstance(answers, list):
+        raise ValueError("previous_answers must be a list")
+    return strategy, difficulty, answers
+
+
+def adapt_difficulty(difficulties, answers, start=START_DIFFICULTY, window=ADAPTIVE_WINDOW):
+    '''
+    adapt_difficulty(difficulties, answers, start, window)
+        returns the difficulty of the next adaptive question from the difficulties of the questions asked so far
+        and whether each answer was right: one step harder than the last question when at least three quarters
+        of the last window answers were right, one step easier when at most a quarter were, the same otherwise.
+    '''
+    if not difficulties:
+        return start
+    level = difficulties[-1]
+    recent = answers[-window:]
+    if recent:
+        share = sum(1 for answer in recent if answer) / len(recent)
+        if share >= 0.75:
+            level += 1
+        elif share <= 0.25:
+            level -= 1
+    return min(max(level, 1), 5)
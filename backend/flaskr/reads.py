@@ -0,0 +1,39 @@
+from sqlalchemy import select
+
+from models import db, Question
+
+'''
+Read-only access to questions that selects plain column tuples instead of hydrating
+Question instances, so reads skip the identity map and session bookkeeping.
+format_row builds exactly what Question.format() returns for the same row.
+'''
+
+FIELDS = ("id", "question", "answer", "category", "difficulty")
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in FIELDS)
+
+
+def question_rows():
+    '''
+    question_rows()
+        returns a query over (id, question, answer, category, difficulty) tuples.
+        It filters and orders like Question.query.
+    '''
+    return db.session.query(*QUESTION_COLUMNS)
+
+
+def format_row(row):
+    return dict(zip(FIELDS, row))
+
+
+def get_question(id, primary=False):
+    '''
+    get_question(id, primary)
+        returns the format() dict of the question with the given id, or None.
+        With primary it is read from the primary, even in a request routed to a read replica.
+    '''
+    if primary:
+        with db.engine.connect() as connection:
+            row = connection.execute(select(*QUESTION_COLUMNS).where(Question.id == id)).first()
+    else:
+        row = question_rows().filter(Question.id == id).first()
+    return format_row(row) if row is not None else None
@@ -0,0 +1,180 @@
+import itertools
+import threading
+import time
+
+from flask import g, has_app_context, request
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from models import db, engine_options, get_setting
+
+BALANCING = ("round_robin", "least_connections")
+STICKY_COOKIE = "trivia_primary_until"
+CONNECT_TIMEOUT = 2
+
+'''
+Read replica routing, enabled by listing replica URLs in DATABASE_REPLICAS.
+
+Requests to views marked with @read_only run every statement on one healthy replica,
+picked round robin or by the fewest requests in flight. Everything else goes to the primary.
+A write sets a cookie that keeps the client's reads on the primary for DB_REPLICA_STICKY_SECONDS,
+so a client reads its own writes while the replicas catch up. Those reads also skip the response
+cache, which reads from a lagging replica may have filled after the write.
+Replicas are checked with SELECT 1 every DB_REPLICA_HEALTH_INTERVAL seconds by a background
+thread. When none is healthy, reads fall back to the primary.
+'''
+
+
+def read_only(view):
+    view.read_only = True
+    return view
+
+
+def pinned_to_primary():
+    '''
+    pinned_to_primary()
+        True when a read only request stays on the primary because its client wrote in the last
+        DB_REPLICA_STICKY_SECONDS. Caches that replica reads fill must not answer it.
+    '''
+    return has_app_context() and g.get("pinned_to_primary", False)
+
+
+def on_replica():
+    '''
+    on_replica()
+        True when the statements of the current request run on a read replica, which may lag behind the primary.
+    '''
+    return has_app_context() and g.get("replica") is not None
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.in_flight = 0
+
+
+class ReplicaSet:
+    '''
+    ReplicaSet(replicas, balancing, health_interval)
+        picks a healthy replica per request and checks their health in the background.
+    '''
+
+    def __init__(self, replicas, balancing="round_robin", health_interval=5):
+        if balancing not in BALANCING:
+            raise ValueError(f"Unsupported replica balancing: {balancing}")
+        self.replicas = replicas
+        self.balancing = balancing
+        self.health_interval = health_interval
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.checker = None
+
+    def check(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            replica.healthy = True
+        except Exception:
+            replica.healthy = False
+
+    def check_forever(self):
+        while True:
+            for replica in self.replicas:
+                self.check(replica)
+            time.sleep(self.health_interval)
+
+    def ensure_checking(self):
+        # started on first use, a thread started before a fork does not run in the workers
+        if self.checker is None or not self.checker.is_alive():
+            with self.lock:
+                if self.checker is None or not self.checker.is_alive():
+                    self.checker = threading.Thread(target=self.check_forever, name="replica-health", daemon=True)
+                    self.checker.start()
+
+    def acquire(self):
+        '''
+        acquire()
+            returns a healthy replica and counts the request in flight, or None when no replica is healthy.
+        '''
+        self.ensure_checking()
+        with self.lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                return None
+            if self.balancing == "least_connections":
+                replica = min(healthy, key=lambda replica: replica.in_flight)
+            else:
+                replica = healthy[next(self.counter) % len(healthy)]
+            replica.in_flight += 1
+            return replica
+
+    def release(self, replica):
+        with self.lock:
+            replica.in_flight -= 1
+
+    def status(self):
+        return [{"replica": replica.name, "healthy": replica.healthy, "in_flight": replica.in_flight}
+                for replica in self.replicas]
+
+
+def replica_urls(app):
+    urls = get_setting(app, "DATABASE_REPLICAS")
+    if isinstance(urls, str):
+        urls = [url.strip() for url in urls.split(",")]
+    return [url for url in urls if url]
+
+
+def create_replica_engine(app, url):
+    options = engine_options(app, url)
+    if url.startswith("postgres"):
+        options["connect_args"] = {**options.get("connect_args", {}), "connect_timeout": CONNECT_TIMEOUT}
+    return db.create_engine(make_url(url), options)
+
+
+def init_replicas(app):
+    '''
+    init_replicas(app)
+        routes the read only views of the app to the replicas in DATABASE_REPLICAS.
+        Returns the ReplicaSet, or None when no replica is configured.
+    '''
+    urls = replica_urls(app)
+    if not urls:
+        return None
+
+    replicas = ReplicaSet([Replica(repr(make_url(url)), create_replica_engine(app, url)) for url in urls],
+                          get_setting(app, "DB_REPLICA_BALANCING"), get_setting(app, "DB_REPLICA_HEALTH_INTERVAL"))
+    sticky_seconds = get_setting(app, "DB_REPLICA_STICKY_SECONDS")
+
+    def is_read_only():
+        return getattr(app.view_functions.get(request.endpoint), "read_only", False)
+
+    @app.before_request
+    def route_reads():
+        if not is_read_only():
+            return
+        try:
+            primary_until = float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        if primary_until < time.time():
+            g.replica = replicas.acquire()
+        else:
+            g.pinned_to_primary = True
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method in ("POST", "PUT", "PATCH", "DELETE") and not is_read_only() \
+                and response.status_code < 400 and sticky_seconds > 0:
+            response.set_cookie(STICKY_COOKIE, f"{time.time() + sticky_seconds:.3f}", max_age=sticky_seconds,
+                                httponly=True, samesite="Lax")
+        return response
+
+    @app.teardown_request
+    def release_replica(error):
+        replica = g.pop("replica", None)
+        if replica is not None:
+            replicas.release(replica)
+
+    return replicas
@@ -0,0 +1,232 @@
+import re
+import threading
+import time
+
+from sqlalchemy import func, inspect, literal_column, or_
+
+from models import db, Question
+from .reads import question_rows, format_row
+from .streaming import STREAM_BATCH_SIZE
+
+TOKEN = re.compile(r"\w+")
+SEARCH_INDEX_TTL = 60
+
+'''
+Question search keeps the substring, case-insensitive semantics of the former
+`question ILIKE '%term%'` filter, but answers it from an index.
+
+On Postgres the `search_vector` column, its GIN index and the pg_trgm index added by
+migrations/0001_question_search.postgresql.sql are used: full-text matches rank first and the
+trigram index serves substring matches.
+Elsewhere (SQLite, tests) a pure-Python trigram inverted index is built on first use,
+kept up to date by question listeners and rebuilt in the background every SEARCH_INDEX_TTL
+seconds to pick up writes made by other processes.
+'''
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    '''
+    TrigramIndex
+        maps every 3 character substring of the lowercased question text to the ids containing it.
+        Candidates are the intersection of the query trigrams, verified against the text.
+    '''
+
+    def __init__(self):
+        self.postings = {}
+        self.texts = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, id, text):
+        text = (text or "").lower()
+        with self.lock:
+            self.texts[id] = text
+            for trigram in trigrams(text):
+                self.postings.setdefault(trigram, set()).add(id)
+
+    def remove(self, id):
+        with self.lock:
+            text = self.texts.pop(id, None)
+            if text is None:
+                return
+            for trigram in trigrams(text):
+                ids = self.postings.get(trigram)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del self.postings[trigram]
+
+    def candidates(self, term):
+        if len(term) < 3:
+            return list(self.texts)
+        postings = [self.postings.get(t) for t in trigrams(term)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        ids = set(postings[0])
+        for other in postings[1:]:
+            ids &= other
+            if not ids:
+                break
+        return ids
+
+    def search(self, term):
+        '''
+        search(term)
+            returns the ids of questions containing term, best matches first:
+            more query words matched as whole words, then more occurrences, then lower id.
+        '''
+        term = term.lower()
+        # writers change the postings and texts under the lock, matches are ranked on a copy outside of it
+        with self.lock:
+            texts = {id: self.texts.get(id) for id in self.candidates(term)}
+        matches = [id for id, text in texts.items() if text is not None and term in text]
+        if not term:
+            return sorted(matches)
+
+        words = set(TOKEN.findall(term))
+
+        def rank(id):
+            text = texts[id]
+            return -len(words & set(TOKEN.findall(text))), -text.count(term), id
+
+        return sorted(matches, key=rank)
+
+
+class QuestionSearch:
+    '''
+    QuestionSearch(engine, ttl)
+        engine is "postgres", "memory" or "auto", which picks postgres when the
+        search_vector column exists. It is resolved on first use.
+    '''
+
+    def __init__(self, engine="auto", ttl=SEARCH_INDEX_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self.index = None
+        self.loaded_at = None
+        self.changes = None
+        self.lock = threading.Lock()
+        self.changes_lock = threading.Lock()
+
+    def resolve_engine(self):
+        if self.engine == "auto":
+            columns = {c["name"] for c in inspect(db.engine).get_columns(Question.__tablename__)}
+            is_postgres = db.engine.dialect.name == "postgresql"
+            self.engine = "postgres" if is_postgres and "search_vector" in columns else "memory"
+            if is_postgres and self.engine == "memory":
+                db.get_app().logger.warning("questions.search_vector is missing, run `flask migrate`. "
+                                            "Searching an in-memory index of every question meanwhile.")
+        return self.engine
+
+    def build_index(self):
+        index = TrigramIndex()
+        for id, text in db.session.query(Question.id, Question.question).yield_per(10000):
+            index.add(id, text)
+        return index
+
+    def load(self):
+        with self.changes_lock:
+            self.changes = []
+        try:
+            index = self.build_index()
+        except Exception:
+            self.changes = None
+            raise
+
+        with self.changes_lock:
+            changes, self.changes = self.changes, None
+            self.index = index
+            self.loaded_at = time.monotonic()
+            # writes committed while the table was read may be missing from it
+            for action, question in changes:
+                self.apply(action, question)
+
+    def ensure_index(self):
+        if self.loaded_at is None:
+            # the first search, or the first one after a bulk write, waits for the index
+            with self.lock:
+                if self.loaded_at is None:
+                    self.load()
+        elif time.monotonic() - self.loaded_at > self.ttl:
+            self.refresh()
+        return self.index
+
+    def refresh(self):
+        '''
+        refresh()
+            rebuilds the index in a background thread unless a rebuild is already running.
+            Searches keep using the current index until the new one is swapped in.
+        '''
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            app = db.get_app()
+            threading.Thread(target=self.reload, args=(app,), name="search-index-reload", daemon=True).start()
+        except Exception:
+            self.lock.release()
+            raise
+
+    def reload(self, app):
+        try:
+            with app.app_context():
+                self.load()
+        except Exception:
+            # keep the current index, the next search after the ttl tries again
+            if self.loaded_at is not None:
+                self.loaded_at = time.monotonic()
+            app.logger.exception("Search index reload failed")
+        finally:
+            self.lock.release()
+
+    def on_question_change(self, action, question):
+        with self.changes_lock:
+            if self.changes is not None:
+                self.changes.append((action, question))
+            if self.index is not None:
+                self.apply(action, question)
+
+    def apply(self, action, question):
+        if action == "reload":
+            self.loaded_at = None
+            return
+        self.index.remove(question["id"])
+        if action != "delete":
+            self.index.add(question["id"], question["question"])
+
+    def search(self, term, offset=0, limit=None):
+        '''
+        search(term, offset, limit)
+            yields the format() dicts of the matching questions in rank order,
+            fetching them from the database STREAM_BATCH_SIZE rows at a time.
+        '''
+        if self.resolve_engine() == "postgres":
+            for row in self.search_postgres(term, offset, limit):
+                yield format_row(row)
+            return
+
+        ids = self.ensure_index().search(term)
+        ids = ids[offset:offset + limit] if limit is not None else ids[offset:]
+        for start in range(0, len(ids), STREAM_BATCH_SIZE):
+            batch = ids[start:start + STREAM_BATCH_SIZE]
+            rows = {row.id: row for row in question_rows().filter(Question.id.in_(batch))}
+            for id in batch:
+                if id in rows:
+                    yield format_row(rows[id])
+
+    def search_postgres(self, term, offset, limit):
+        vector = literal_column("questions.search_vector")
+        query = func.plainto_tsquery("english", term)
+        rows = question_rows() \
+            .filter(or_(vector.op("@@")(query), Question.question.ilike(f"%{term}%"))) \
+            .order_by(func.ts_rank(vector, query).desc(), Question.id) \
+            .offset(offset)
+        if limit is not None:
+            rows = rows.limit(limit)
+        return rows.yield_per(STREAM_BATCH_SIZE)
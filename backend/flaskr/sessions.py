@@ -0,0 +1,261 @@
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+SESSION_TTL = 60 * 60
+MAX_SESSIONS = 10000
+SWEEP_INTERVAL = 60
+# shared by every worker on the host, a session may reach any of them
+DEFAULT_SESSION_STORE = "sqlite:///" + os.path.join(tempfile.gettempdir(), "trivia_quiz_sessions.sqlite3")
+
+'''
+Quiz sessions keep the state of a running quiz on the server so the client
+no longer sends the growing list of previous questions on every turn.
+
+A session is a plain dict: {"category": <id>, "asked": <count>, "first": <id of the first question or None>}.
+Stores keep the ids asked in every session beside it. claim(session_id, id) records an id only if the
+session has not asked it yet, so two requests of one session never get the same question.
+A turn costs a few key lookups however long the quiz runs.
+'''
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class SeenQuestions:
+    '''
+    SeenQuestions(store, session_id, session)
+        the questions a session has asked, as QuizIndex.next_question takes its previous questions:
+        the first one and how many there are, which resume the walk of a deck, and a membership test
+        answered by the store.
+    '''
+
+    def __init__(self, store, session_id, session):
+        self.store = store
+        self.session_id = session_id
+        self.session = session
+
+    def __len__(self):
+        return self.session["asked"]
+
+    def __getitem__(self, index):
+        if index != 0 or self.session["first"] is None:
+            raise IndexError(index)
+        return self.session["first"]
+
+    def __contains__(self, id):
+        return self.store.is_seen(self.session_id, id)
+
+    def __iter__(self):
+        return iter(self.store.seen(self.session_id))
+
+
+class MemorySessionStore:
+    '''
+    MemorySessionStore(max_sessions, ttl)
+        keeps sessions in process, evicting the least recently used one beyond max_sessions
+        and any session that has not been touched for ttl seconds.
+        Only for a single process: another worker does not know the sessions of this one.
+    '''
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entry(self, session_id):
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.sessions[session_id]
+            return None
+        self.sessions.move_to_end(session_id)
+        return entry
+
+    def create(self, session_id, category):
+        with self.lock:
+            session = {"category": category, "asked": 0, "first": None}
+            # [expires at, session, ids asked]
+            self.sessions[session_id] = [time.monotonic() + self.ttl, session, set()]
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def get(self, session_id):
+        with self.lock:
+            entry = self.entry(session_id)
+            return dict(entry[1]) if entry is not None else None
+
+    def is_seen(self, session_id, id):
+        with self.lock:
+            entry = self.entry(session_id)
+            return entry is not None and id in entry[2]
+
+    def seen(self, session_id):
+        with self.lock:
+            entry = self.entry(session_id)
+            return list(entry[2]) if entry is not None else []
+
+    def claim(self, session_id, id):
+        '''
+        claim(session_id, id)
+            records that the session asked the question. Returns False when it already did,
+            None when the session does not exist.
+        '''
+        with self.lock:
+            entry = self.entry(session_id)
+            if entry is None:
+                return None
+            expires_at, session, seen = entry
+            if id in seen:
+                return False
+            seen.add(id)
+            session["asked"] += 1
+            if session["first"] is None:
+                session["first"] = id
+            entry[0] = time.monotonic() + self.ttl
+            return True
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+
+class SQLiteSessionStore:
+    '''
+    SQLiteSessionStore(path, ttl, sweep_interval)
+        keeps sessions in a local SQLite file so they are shared by every worker on the host
+        and survive restarts. A session row holds its counters and every asked question is a row
+        keyed by (session, question), so a turn is an indexed lookup and an insert.
+        Expired sessions are purged by a background thread every sweep_interval seconds.
+    '''
+
+    def __init__(self, path, ttl=SESSION_TTL, sweep_interval=SWEEP_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sweeper = None
+        with closing(sqlite3.connect(self.path, timeout=5)) as connection, connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS quiz_session_counters (id TEXT PRIMARY KEY, "
+                               "category INTEGER NOT NULL, asked INTEGER NOT NULL, first INTEGER, "
+                               "expires_at REAL NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS quiz_session_questions (session_id TEXT NOT NULL, "
+                               "question_id INTEGER NOT NULL, PRIMARY KEY (session_id, question_id)) WITHOUT ROWID")
+
+    def connection(self):
+        # one connection per thread, in autocommit mode so claim() controls its transaction
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return connection
+
+    def create(self, session_id, category):
+        self.ensure_sweeping()
+        self.connection().execute("INSERT INTO quiz_session_counters (id, category, asked, first, expires_at) "
+                                  "VALUES (?, ?, 0, NULL, ?)", (session_id, category, time.time() + self.ttl))
+
+    def get(self, session_id):
+        row = self.connection().execute("SELECT category, asked, first FROM quiz_session_counters "
+                                        "WHERE id = ? AND expires_at >= ?", (session_id, time.time())).fetchone()
+        return dict(zip(("category", "asked", "first"), row)) if row else None
+
+    def is_seen(self, session_id, id):
+        return self.connection().execute("SELECT 1 FROM quiz_session_questions WHERE session_id = ? "
+                                         "AND question_id = ?", (session_id, id)).fetchone() is not None
+
+    def seen(self, session_id):
+        return [id for id, in self.connection().execute(
+            "SELECT question_id FROM quiz_session_questions WHERE session_id = ?", (session_id,))]
+
+    def claim(self, session_id, id):
+        '''
+        claim(session_id, id)
+            records that the session asked the question in one transaction. Returns False when it already did,
+            None when the session does not exist.
+        '''
+        connection = self.connection()
+        now = time.time()
+        # takes the write lock up front, concurrent claims of the session run one after the other
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = connection.execute("UPDATE quiz_session_counters SET asked = asked + 1, "
+                                        "first = coalesce(first, ?), expires_at = ? WHERE id = ? AND expires_at >= ?",
+                                        (id, now + self.ttl, session_id, now))
+            if cursor.rowcount == 0:
+                connection.execute("ROLLBACK")
+                return None
+            cursor = connection.execute("INSERT OR IGNORE INTO quiz_session_questions (session_id, question_id) "
+                                        "VALUES (?, ?)", (session_id, id))
+            if cursor.rowcount == 0:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute("COMMIT")
+            return True
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def delete(self, session_id):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = connection.execute("DELETE FROM quiz_session_counters WHERE id = ?", (session_id,))
+            connection.execute("DELETE FROM quiz_session_questions WHERE session_id = ?", (session_id,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return cursor.rowcount > 0
+
+    def purge(self):
+        '''
+        purge()
+            deletes the sessions that expired and the questions they asked.
+        '''
+        with closing(sqlite3.connect(self.path, timeout=5)) as connection, connection:
+            now = time.time()
+            connection.execute("DELETE FROM quiz_session_questions WHERE session_id IN "
+                               "(SELECT id FROM quiz_session_counters WHERE expires_at < ?)", (now,))
+            connection.execute("DELETE FROM quiz_session_counters WHERE expires_at < ?", (now,))
+
+    def sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.purge()
+            except sqlite3.Error:
+                # busy or gone for now, the next sweep tries again
+                pass
+
+    def ensure_sweeping(self):
+        # started on first use, a thread started before a fork does not run in the workers
+        if self.sweeper is None or not self.sweeper.is_alive():
+            with self.lock:
+                if self.sweeper is None or not self.sweeper.is_alive():
+                    self.sweeper = threading.Thread(target=self.sweep_forever, name="quiz-session-sweep",
+                                                    daemon=True)
+                    self.sweeper.start()
+
+
+def create_session_store(uri=DEFAULT_SESSION_STORE, ttl=SESSION_TTL):
+    '''
+    create_session_store(uri)
+        builds a store from the QUIZ_SESSION_STORE setting: "memory" or "sqlite:///<path>".
+        Defaults to a SQLite file in the temp directory, shared by the workers of the host.
+    '''
+    if uri == "memory":
+        return MemorySessionStore(ttl=ttl)
+    if uri.startswith("sqlite:///"):
+        return SQLiteSessionStore(uri[len("sqlite:///"):], ttl=ttl)
+    raise ValueError(f"Unsupported quiz session store: {uri}")
@@ -0,0 +1,424 @@
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from models import db, Category
+from .pagination import encode_cursor, decode_cursor
+from .reads import question_rows
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock
+    fcntl = None
+    import msvcrt
+
+SNAPSHOT_TTL = 60
+MAGIC = b"TRVQ"
+LAYOUT = 1
+HEADER = struct.Struct("<4sIqq")
+STAMP = struct.Struct("<q")
+NULL = -2 ** 31
+ALIGNMENT = 8
+
+'''
+Read-through store that serves every read endpoint from a columnar snapshot of the question bank.
+
+The snapshot is one file: a header, a JSON table of contents and sections of typed arrays
+(ids, categories, difficulties, text offsets and lookup indexes) and UTF-8 text buffers.
+Questions are stored in (difficulty, id) order, the pagination order, so a page is a slice
+and a cursor a binary search. Every worker maps the file read only, and as it lives on
+/dev/shm when available, the host keeps one copy in memory however many workers read it.
+
+Writes bump a generation counter in a small shared stamp file. The next read in any worker
+on the host sees that the mapped snapshot is older than the stamp and refreshes it: one process
+rebuilds the file under an exclusive lock and atomically renames it into place, and the others
+map the new file. Readers keep their old mapping until they are done with it.
+Writes made on other hosts are picked up after SNAPSHOT_TTL seconds.
+'''
+
+
+def default_directory():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def sort_key(difficulty, id):
+    # Postgres sorts NULL difficulties last
+    return (difficulty is None, difficulty or 0, id)
+
+
+def packed(value):
+    return NULL if value is None else value
+
+
+def unpacked(value):
+    return None if value == NULL else value
+
+
+def text_section(texts):
+    buffer = bytearray()
+    offsets = array.array("q", [0])
+    for text in texts:
+        buffer += (text or "").encode()
+        offsets.append(len(buffer))
+    return offsets, bytes(buffer)
+
+
+def build_snapshot(questions, categories, generation=0, built_at=None):
+    '''
+    build_snapshot(questions, categories, generation, built_at)
+        returns the bytes of a snapshot of the format() dicts in questions and the {id: type} map in categories.
+    '''
+    questions = sorted(questions, key=lambda q: sort_key(q["difficulty"], q["id"]))
+    count = len(questions)
+
+    positions_by_id = sorted(range(count), key=lambda position: questions[position]["id"])
+    positions_by_category = {}
+    for position, question in enumerate(questions):
+        positions_by_category.setdefault(packed(question["category"]), []).append(position)
+    category_keys = sorted(positions_by_category)
+    category_starts = array.array("q", [0])
+    category_rows = array.array("q")
+    for key in category_keys:
+        category_rows.extend(positions_by_category[key])
+        category_starts.append(len(category_rows))
+
+    texts = []
+    for question in questions:
+        texts += [question["question"], question["answer"]]
+    text_offsets, text = text_section(texts)
+    # lowercase text for case insensitive search, separated so a match cannot span two questions
+    search_offsets, search_text = text_section((question["question"] or "").lower() + "\0" for question in questions)
+    category_ids = sorted(categories)
+    name_offsets, names = text_section(categories[id] for id in category_ids)
+
+    sections = {
+        "ids": array.array("q", (question["id"] for question in questions)),
+        "categories": array.array("q", (packed(question["category"]) for question in questions)),
+        "difficulties": array.array("q", (packed(question["difficulty"]) for question in questions)),
+        "text_offsets": text_offsets,
+        "text": text,
+        "search_offsets": search_offsets,
+        "search_text": search_text,
+        "sorted_ids": array.array("q", (questions[position]["id"] for position in positions_by_id)),
+        "id_rows": array.array("q", positions_by_id),
+        "category_keys": array.array("q", category_keys),
+        "category_starts": category_starts,
+        "category_rows": category_rows,
+        "category_ids": array.array("q", category_ids),
+        "name_offsets": name_offsets,
+        "names": names
+    }
+
+    contents = {"built_at": built_at if built_at is not None else time.time(), "questions": count, "sections": {}}
+    body = bytearray()
+    for name, section in sections.items():
+        data = section.tobytes() if isinstance(section, array.array) else section
+        body += b"\0" * (-len(body) % ALIGNMENT)
+        contents["sections"][name] = [len(body), len(data)]
+        body += data
+
+    toc = json.dumps(contents).encode()
+    toc += b" " * (-(HEADER.size + len(toc)) % ALIGNMENT)
+    return HEADER.pack(MAGIC, LAYOUT, generation, len(toc)) + toc + bytes(body)
+
+
+class Snapshot:
+    '''
+    Snapshot(buffer)
+        reads a snapshot in place from bytes or a read only mmap. Nothing is copied
+        until a question is formatted.
+    '''
+
+    def __init__(self, buffer):
+        magic, layout, self.generation, toc_size = HEADER.unpack_from(buffer)
+        if magic != MAGIC or layout != LAYOUT:
+            raise ValueError("Not a question snapshot")
+        contents = json.loads(bytes(buffer[HEADER.size:HEADER.size + toc_size]))
+        self.buffer = buffer
+        self.built_at = contents["built_at"]
+        self.size = len(buffer)
+        view = memoryview(buffer)[HEADER.size + toc_size:]
+        for name, (offset, length) in contents["sections"].items():
+            section = view[offset:offset + length]
+            setattr(self, name, section if name in ("text", "search_text", "names") else section.cast("q"))
+        # bytes and mmap search in C, the search section is searched in place through them
+        offset, length = contents["sections"]["search_text"]
+        self.search_start = HEADER.size + toc_size + offset
+        self.search_end = self.search_start + length
+        self.listing = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def question(self, position):
+        offsets = self.text_offsets
+        start, middle, end = offsets[2 * position], offsets[2 * position + 1], offsets[2 * position + 2]
+        return {
+            "id": self.ids[position],
+            "question": str(self.text[start:middle], "utf-8"),
+            "answer": str(self.text[middle:end], "utf-8"),
+            "category": unpacked(self.categories[position]),
+            "difficulty": unpacked(self.difficulties[position])
+        }
+
+    def get(self, id):
+        '''
+        get(id)
+            returns the format() dict of the question with the given id, or None.
+        '''
+        position = bisect_left(self.sorted_ids, id)
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == id:
+            return self.question(self.id_rows[position])
+        return None
+
+    def category_range(self, category):
+        position = bisect_left(self.category_keys, packed(category))
+        if position < len(self.category_keys) and self.category_keys[position] == packed(category):
+            return self.category_starts[position], self.category_starts[position + 1]
+        return 0, 0
+
+    def total(self):
+        return len(self.ids)
+
+    def in_category(self, category):
+        start, end = self.category_range(int(category))
+        return end - start
+
+    def seek(self, rows, after):
+        # first row after the (difficulty, id) cursor, rows are positions in key order
+        key = sort_key(*decode_cursor(after))
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high) // 2
+            position = rows[middle]
+            if sort_key(unpacked(self.difficulties[position]), self.ids[position]) > key:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def page(self, rows, per_page, page=1, after=None):
+        start = self.seek(rows, after) if after is not None else (page - 1) * per_page
+        end = min(start + per_page, len(rows))
+        questions = [self.question(rows[index]) for index in range(start, end)]
+        next_cursor = None
+        if end < len(rows) and questions:
+            next_cursor = encode_cursor(questions[-1]["difficulty"], questions[-1]["id"])
+        return questions, next_cursor
+
+    def questions_page(self, per_page, page=1, after=None):
+        '''
+        questions_page(per_page, page, after)
+            returns a page of questions ordered by (difficulty, id) and the cursor of the next page, like paginate().
+        '''
+        return self.page(range(len(self.ids)), per_page, page, after)
+
+    def category_questions(self, category, limit=None, after=None):
+        '''
+        category_questions(category, limit, after)
+            returns the questions of a category ordered by (difficulty, id), all of them or a page of limit,
+            and the cursor of the next page.
+        '''
+        start, end = self.category_range(category)
+        rows = self.category_rows[start:end]
+        if limit is None:
+            return (self.question(position) for position in rows), None
+        return self.page(rows, limit, after=after)
+
+    def search(self, term, offset=0, limit=None):
+        '''
+        search(term, offset, limit)
+            yields the questions whose text contains term, ignoring case, in (difficulty, id) order.
+        '''
+        needle = term.lower().encode()
+        offsets = self.search_offsets
+        found = position = 0
+        while limit is None or found < offset + limit:
+            match = self.buffer.find(needle, self.search_start + position, self.search_end)
+            # a blank needle also matches at the very end of the texts
+            if match < 0 or match >= self.search_end:
+                return
+            row = bisect_right(offsets, match - self.search_start) - 1
+            if found >= offset:
+                yield self.question(row)
+            found += 1
+            position = offsets[row + 1]
+
+    def quiz_rows(self):
+        '''
+        quiz_rows()
+            yields (id, category, difficulty) ordered by id, as QuizIndex loads them.
+        '''
+        for position in self.id_rows:
+            yield self.ids[position], unpacked(self.categories[position]), unpacked(self.difficulties[position])
+
+    def category_listing(self):
+        '''
+        category_listing()
+            returns (categories, body, etag) like CategoryCache.get().
+        '''
+        if self.listing is None:
+            offsets = self.name_offsets
+            categories = {id: str(self.names[offsets[index]:offsets[index + 1]], "utf-8")
+                          for index, id in enumerate(self.category_ids)}
+            body = json.dumps({"success": True, "categories": categories}, sort_keys=True)
+            self.listing = (categories, body, hashlib.sha1(body.encode()).hexdigest())
+        return self.listing
+
+
+def bisect_left(values, value):
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def bisect_right(values, value):
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if value < values[middle]:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def lock_file(file):
+    '''
+    lock_file(file)
+        blocks until this process holds an exclusive lock on the open file, released when it is closed.
+    '''
+    if fcntl is not None:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return
+    file.seek(0)
+    while True:
+        try:
+            # LK_LOCK gives up after about 10 seconds
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+class SnapshotStore:
+    '''
+    SnapshotStore(database_url, directory, ttl)
+        shares one snapshot file per database and host between every worker process.
+        current() returns a Snapshot at least as new as the last write made on this host.
+    '''
+
+    def __init__(self, database_url, directory=None, ttl=SNAPSHOT_TTL):
+        name = "trivia-" + hashlib.sha1(database_url.encode()).hexdigest()[:12]
+        self.path = os.path.join(directory or default_directory(), name)
+        self.ttl = ttl
+        self.snapshot = None
+        self.stamp = None
+        self.rebuilds = 0
+        self.lock = threading.Lock()
+        self.stamp_lock = threading.Lock()
+
+    def open_stamp(self):
+        if self.stamp is None:
+            with self.stamp_lock:
+                if self.stamp is None:
+                    fd = os.open(self.path + ".stamp", os.O_RDWR | os.O_CREAT, 0o600)
+                    try:
+                        if os.fstat(fd).st_size < STAMP.size:
+                            os.ftruncate(fd, STAMP.size)
+                        self.stamp = mmap.mmap(fd, STAMP.size)
+                    finally:
+                        os.close(fd)
+        return self.stamp
+
+    def generation(self):
+        return STAMP.unpack_from(self.open_stamp())[0]
+
+    def bump(self):
+        stamp = self.open_stamp()
+        with open(self.path + ".stamp-lock", "a") as lock:
+            lock_file(lock)
+            STAMP.pack_into(stamp, 0, STAMP.unpack_from(stamp)[0] + 1)
+
+    def is_fresh(self, snapshot, generation):
+        return snapshot is not None and snapshot.generation == generation \
+            and time.time() - snapshot.built_at <= self.ttl
+
+    def map(self):
+        try:
+            with open(self.path + ".snapshot", "rb") as file:
+                return Snapshot(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            return None
+
+    def build(self, generation):
+        questions = (dict(zip(("id", "question", "answer", "category", "difficulty"), row))
+                     for row in question_rows().yield_per(10000))
+        categories = {id: type for id, type in db.session.query(Category.id, Category.type)}
+        data = build_snapshot(questions, categories, generation)
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=os.path.basename(self.path))
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(path, self.path + ".snapshot")
+        self.rebuilds += 1
+
+    def refresh(self):
+        with self.lock:
+            generation = self.generation()
+            if self.is_fresh(self.snapshot, generation):
+                return self.snapshot
+            with open(self.path + ".build-lock", "a") as lock:
+                # one process rebuilds, the others wait and map its file
+                lock_file(lock)
+                snapshot = self.map()
+                if not self.is_fresh(snapshot, generation):
+                    self.build(generation)
+                    snapshot = self.map()
+            self.snapshot = snapshot
+            return snapshot
+
+    def current(self):
+        snapshot = self.snapshot
+        if not self.is_fresh(snapshot, self.generation()):
+            snapshot = self.refresh()
+        return snapshot
+
+    def on_question_change(self, action, question):
+        self.bump()
+
+    def on_category_change(self, action, category):
+        self.bump()
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "generation": snapshot.generation if snapshot is not None else None,
+            "questions": len(snapshot) if snapshot is not None else 0,
+            "bytes": snapshot.size if snapshot is not None else 0,
+            "age_seconds": round(time.time() - snapshot.built_at, 3) if snapshot is not None else None,
+            "rebuilds": self.rebuilds
+        }
+
+
+def create_question_store(mode, database_url, directory=None, ttl=SNAPSHOT_TTL):
+    '''
+    create_question_store(mode, database_url)
+        returns a SnapshotStore for the QUESTION_STORE setting "snapshot", or None for "database".
+    '''
+    if mode == "database":
+        return None
+    if mode == "snapshot":
+        return SnapshotStore(database_url, directory, ttl)
+    raise ValueError(f"Unsupported question store: {mode}")
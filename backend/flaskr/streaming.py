@@ -0,0 +1,38 @@
+import itertools
+
+from flask import json
+
+STREAM_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def peek(items):
+    '''
+    peek(items)
+        returns (first item or None, an iterator over all items) without losing the first one.
+    '''
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        return None, iter(())
+    return first, itertools.chain([first], items)
+
+
+def stream_json(fields, key, items):
+    '''
+    stream_json(fields, key, items)
+        yields a JSON object with the given fields and a `key` array of the items,
+        encoded one item at a time and flushed in chunks of about CHUNK_SIZE bytes.
+    '''
+    chunk = [json.dumps(fields)[:-1], ", " if fields else "", json.dumps(key), ": ["]
+    size = 0
+    for index, item in enumerate(items):
+        encoded = json.dumps(item)
+        chunk.append(", " + encoded if index else encoded)
+        size += len(encoded)
+        if size >= CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+
+    chunk.append("]}\n")
+    yield "".join(chunk)
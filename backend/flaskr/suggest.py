@@ -0,0 +1,254 @@
+import bisect
+import sys
+import threading
+import time
+import unicodedata
+
+from models import db, Question
+from .search import TOKEN
+
+SUGGEST_TTL = 60
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+MAX_TOKENS = 200_000
+MAX_IDS_PER_TOKEN = 1000
+MAX_SCANNED_TOKENS = 256
+SNIPPET_LENGTH = 80
+# approximate bytes of a new token: its slot in the sorted list, its dict entry and its empty id list
+TOKEN_OVERHEAD = 8 + 24 + sys.getsizeof([])
+# a pointer to the id in a list or tuple, and a dict entry per question
+POINTER = 8
+ENTRY = 24
+
+'''
+Autocomplete for the search box, answered from an in-memory prefix index instead of a
+substring scan of the question bodies.
+
+Question texts are split into tokens, lowercased and stripped of accents. The distinct tokens
+are kept in a sorted list, so the tokens starting with what the user typed are a bisect and a
+short walk away. Every token maps to the ids of the questions that contain it. The words
+before the last one of the query must match whole tokens, the last one is a prefix.
+Memory is bounded: at most MAX_TOKENS tokens and MAX_IDS_PER_TOKEN ids per token are kept,
+and suggestions carry a snippet of at most SNIPPET_LENGTH characters instead of the question.
+'''
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return TOKEN.findall(normalize(text))
+
+
+def snippet(text, length=SNIPPET_LENGTH):
+    text = " ".join((text or "").split())
+    return text if len(text) <= length else text[:length - 1].rstrip() + "…"
+
+
+class SuggestIndex:
+    '''
+    SuggestIndex(ttl, max_tokens, max_ids_per_token)
+        a sorted token list with the ids of the questions containing every token, and per question
+        its snippet and the tokens it is listed under, which removals and updates need.
+        It is loaded lazily, kept in sync by question listeners and reloaded in the background every ttl seconds
+        to pick up writes made by other processes.
+    '''
+
+    def __init__(self, ttl=SUGGEST_TTL, max_tokens=MAX_TOKENS, max_ids_per_token=MAX_IDS_PER_TOKEN):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.max_ids_per_token = max_ids_per_token
+        self.tokens = []
+        self.postings = {}
+        self.snippets = {}
+        self.terms = {}
+        self.dropped_tokens = 0
+        self.dropped_ids = 0
+        self.bytes = 0
+        self.loaded_at = None
+        self.changes = None
+        # reentrant, as changes replayed by load() add and remove under it
+        self.lock = threading.RLock()
+        self.load_lock = threading.Lock()
+
+    def add(self, id, text):
+        with self.lock:
+            self.put(id, text, bisect.insort)
+
+    def put(self, id, text, insert):
+        # insert(list, item) keeps the token list and the id lists sorted, or appends while building
+        self.snippets[id] = snippet(text)
+        terms = []
+        self.bytes += sys.getsizeof(self.snippets[id]) + 2 * ENTRY
+        # interned, so the sorted list, the postings and the terms of every question share one string per token
+        for token in {sys.intern(token) for token in tokenize(text)}:
+            ids = self.postings.get(token)
+            if ids is None:
+                if len(self.tokens) >= self.max_tokens:
+                    self.dropped_tokens += 1
+                    continue
+                ids = self.postings[token] = []
+                insert(self.tokens, token)
+                self.bytes += sys.getsizeof(token) + TOKEN_OVERHEAD
+            if len(ids) >= self.max_ids_per_token:
+                self.dropped_ids += 1
+                continue
+            insert(ids, id)
+            terms.append(token)
+        self.terms[id] = tuple(terms)
+        self.bytes += sys.getsizeof(self.terms[id]) + len(terms) * POINTER
+
+    def remove(self, id):
+        with self.lock:
+            text = self.snippets.pop(id, None)
+            if text is None:
+                return
+            terms = self.terms.pop(id)
+            self.bytes -= sys.getsizeof(text) + 2 * ENTRY + sys.getsizeof(terms) + len(terms) * POINTER
+            for token in terms:
+                ids = self.postings[token]
+                del ids[bisect.bisect_left(ids, id)]
+                if not ids:
+                    del self.postings[token]
+                    del self.tokens[bisect.bisect_left(self.tokens, token)]
+                    self.bytes -= sys.getsizeof(token) + TOKEN_OVERHEAD
+
+    def build(self, rows):
+        '''
+        build(rows)
+            returns a new index of the (id, text) rows, which come in id order. Tokens and ids are appended
+            and the token list is sorted once at the end, as an insort per new token makes a load quadratic.
+        '''
+        index = SuggestIndex(self.ttl, self.max_tokens, self.max_ids_per_token)
+        for id, text in rows:
+            index.put(id, text, list.append)
+        index.tokens.sort()
+        return index
+
+    def load(self):
+        with self.lock:
+            self.changes = []
+        try:
+            index = self.build(db.session.query(Question.id, Question.question).order_by(Question.id).yield_per(10000))
+        except Exception:
+            self.changes = None
+            raise
+
+        with self.lock:
+            self.tokens = index.tokens
+            self.postings = index.postings
+            self.snippets = index.snippets
+            self.terms = index.terms
+            self.dropped_tokens = index.dropped_tokens
+            self.dropped_ids = index.dropped_ids
+            self.bytes = index.bytes
+            self.loaded_at = time.monotonic()
+            # writes committed while the table was read may be missing from it
+            for action, question in self.changes:
+                self.apply(action, question)
+            self.changes = None
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            # nothing to suggest from yet, the first request loads and the others wait for it
+            with self.load_lock:
+                if self.loaded_at is None:
+                    self.load()
+        elif time.monotonic() - self.loaded_at > self.ttl:
+            self.refresh()
+
+    def refresh(self):
+        '''
+        refresh()
+            reloads the index in a background thread unless a reload is already running.
+            Requests keep using the current index until the new one is swapped in.
+        '''
+        if not self.load_lock.acquire(blocking=False):
+            return
+        try:
+            app = db.get_app()
+            threading.Thread(target=self.reload, args=(app,), name="suggest-index-reload", daemon=True).start()
+        except Exception:
+            self.load_lock.release()
+            raise
+
+    def reload(self, app):
+        try:
+            with app.app_context():
+                self.load()
+        except Exception:
+            # keep the current index, the next request after the ttl tries again
+            if self.loaded_at is not None:
+                self.loaded_at = time.monotonic()
+            app.logger.exception("Suggest index reload failed")
+        finally:
+            self.load_lock.release()
+
+    def on_question_change(self, action, question):
+        with self.lock:
+            if self.changes is not None:
+                self.changes.append((action, question))
+            if self.loaded_at is not None:
+                self.apply(action, question)
+
+    def apply(self, action, question):
+        if action == "reload":
+            self.loaded_at = None
+            return
+        self.remove(question["id"])
+        if action != "delete":
+            self.add(question["id"], question["question"])
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        '''
+        suggest(query, limit)
+            returns up to limit [{"id": <id>, "snippet": <text>}] of questions containing the words of the query,
+            the last word as a prefix. Questions with the typed word itself come first, then by token and id.
+        '''
+        self.ensure_loaded()
+        words = tokenize(query)
+        if not words:
+            return []
+        *complete, prefix = words
+
+        # removals shrink the posting lists in place, so they are walked under the lock.
+        # The walk stops after limit ids, which costs less than copying the lists of the prefix.
+        with self.lock:
+            required = None
+            for word in complete:
+                ids = set(self.postings.get(word, ()))
+                required = ids if required is None else required & ids
+                if not required:
+                    return []
+
+            tokens = self.tokens
+            suggestions, seen = [], set()
+            start = bisect.bisect_left(tokens, prefix)
+            for token in tokens[start:start + MAX_SCANNED_TOKENS]:
+                if not token.startswith(prefix):
+                    break
+                for id in self.postings.get(token, ()):
+                    if id in seen or (required is not None and id not in required):
+                        continue
+                    seen.add(id)
+                    suggestions.append({"id": id, "snippet": self.snippets.get(id, "")})
+                    if len(suggestions) >= limit:
+                        return suggestions
+            return suggestions
+
+    def stats(self):
+        '''
+        stats()
+            returns the size of the index, with an estimate of its memory use in bytes kept up to date by every change.
+        '''
+        return {
+            "questions": len(self.snippets),
+            "tokens": len(self.tokens),
+            "bytes": self.bytes,
+            "dropped_tokens": self.dropped_tokens,
+            "dropped_ids": self.dropped_ids,
+            "max_tokens": self.max_tokens,
+            "max_ids_per_token": self.max_ids_per_token
+        }
@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from models import db, notify_question_listeners, Question
+
+WRITE_QUEUE_SIZE = 1000
+WRITE_BATCH_SIZE = 100
+WRITE_BATCH_DELAY = 0.002
+WRITE_TIMEOUT = 30
+MODES = ("group", "sync")
+
+'''
+Write pipeline of POST /questions.
+
+In "group" mode submissions wait in a bounded queue and a background thread commits them
+in batches of up to WRITE_BATCH_SIZE, gathered for at most WRITE_BATCH_DELAY seconds, so a
+burst of submissions costs one transaction and one fsync per batch instead of one per question.
+Every submission gets a future that resolves to the new id once its batch is committed.
+A full queue raises QueueFull and the route answers 429.
+In "sync" mode every submission is inserted and committed in the request, for tests and
+single threaded servers.
+'''
+
+
+class QueueFull(Exception):
+    pass
+
+
+def insert_questions(rows):
+    '''
+    insert_questions(rows)
+        inserts the question dicts in rows in one transaction and returns the new id, or the exception, of every row.
+        If the database rejects the batch, rows are retried one by one in savepoints so only the failing rows fail.
+    '''
+    table = Question.__table__
+    try:
+        if db.engine.dialect.name == "postgresql":
+            results = [id for id, in db.session.execute(table.insert().values(rows).returning(table.c.id))]
+        else:
+            # no RETURNING for multi row inserts on this dialect
+            results = [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        results = []
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    results.append(db.session.execute(table.insert(), row).inserted_primary_key[0])
+            except Exception as error:
+                results.append(error)
+        db.session.commit()
+
+    for row, result in zip(rows, results):
+        if not isinstance(result, Exception):
+            notify_question_listeners("insert", {"id": result, **row})
+    return results
+
+
+class SyncWritePipeline:
+    '''
+    SyncWritePipeline(app, flush)
+        runs flush(rows) on every submission in the caller's app context.
+    '''
+
+    def __init__(self, app, flush=insert_questions):
+        self.app = app
+        self.flush = flush
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def resolve(self, batch, results):
+        self.batches += 1
+        for (row, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                self.app.logger.warning("Question insert failed: %s", str(getattr(result, "orig", result)).strip())
+                future.set_exception(result)
+            else:
+                self.written += 1
+                future.set_result(result)
+
+    def flush_batch(self, batch):
+        try:
+            results = self.flush([row for row, _ in batch])
+        except Exception as error:
+            self.app.logger.exception("Write batch of %d questions failed", len(batch))
+            results = [error] * len(batch)
+        self.resolve(batch, results)
+
+    def submit(self, row):
+        '''
+        submit(row)
+            queues a question dict and returns a future resolving to its id.
+        '''
+        future = Future()
+        self.flush_batch([(row, future)])
+        return future
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+
+class WritePipeline(SyncWritePipeline):
+    '''
+    WritePipeline(app, flush, max_queue, batch_size, max_delay)
+        group commits submissions from a bounded queue in a background thread.
+    '''
+
+    def __init__(self, app, flush=insert_questions, max_queue=WRITE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE,
+                 max_delay=WRITE_BATCH_DELAY):
+        super().__init__(app, flush)
+        self.queue = queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def ensure_flushing(self):
+        # started on first use, a thread started before a fork does not run in the workers
+        if self.flusher is None or not self.flusher.is_alive():
+            with self.lock:
+                if self.flusher is None or not self.flusher.is_alive():
+                    self.flusher = threading.Thread(target=self.flush_forever, name="question-writes", daemon=True)
+                    self.flusher.start()
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush_forever(self):
+        while True:
+            batch = self.next_batch()
+            with self.app.app_context():
+                self.flush_batch(batch)
+
+    def submit(self, row):
+        future = Future()
+        self.ensure_flushing()
+        try:
+            self.queue.put_nowait((row, future))
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFull()
+        return future
+
+
+def create_write_pipeline(app, mode, max_queue=WRITE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE,
+                          max_delay=WRITE_BATCH_DELAY):
+    if mode == "sync":
+        return SyncWritePipeline(app)
+    if mode == "group":
+        return WritePipeline(app, max_queue=max_queue, batch_size=batch_size, max_delay=max_delay)
+    raise ValueError(f"Unsupported write mode: {mode}")
@@ -0,0 +1,27 @@
+--
+-- Make questions.category an integer foreign key to categories.id and index the
+-- (category, difficulty, id) and (difficulty, id) orderings used by every listing.
+-- Safe to run on databases restored from trivia.psql, where the column already is an integer.
+--
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'questions' AND column_name = 'category') <> 'integer' THEN
+        ALTER TABLE public.questions ALTER COLUMN category TYPE integer USING nullif(category, '')::integer;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'public.questions'::regclass AND contype = 'f') THEN
+        ALTER TABLE ONLY public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES public.categories(id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS questions_category_difficulty_id_idx ON public.questions (category, difficulty, id);
+
+CREATE INDEX IF NOT EXISTS questions_difficulty_id_idx ON public.questions (difficulty, id);
+
+ANALYZE public.questions;
@@ -0,0 +1,10 @@
+--
+-- Index the (category, difficulty, id) and (difficulty, id) orderings used by every listing.
+-- SQLite columns are not retyped: integer affinity already stores categories as integers.
+--
+
+CREATE INDEX IF NOT EXISTS questions_category_difficulty_id_idx ON questions (category, difficulty, id);
+
+CREATE INDEX IF NOT EXISTS questions_difficulty_id_idx ON questions (difficulty, id);
+
+ANALYZE questions;
@@ -1,29 +1,246 @@
-from sqlalchemy import Column, String, Integer
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy_utils import database_exists, create_database
+import os
+import threading
+import time
+
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, orm, text
+from sqlalchemy.pool import QueuePool
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 
 username = "postgres"
 passwd = "postgres"
 host = "localhost:5432"
 database_name = "trivia"
 database_path = "postgres://{}:{}@{}/{}".format(username, passwd, host, database_name)
+default_database_path = database_path
+
+
+class RoutingSession(SignallingSession):
+    '''
+    RoutingSession
+        sends every statement of a request to the read replica chosen for it in g.replica,
+        and to the primary otherwise.
+    '''
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and g.get("replica") is not None:
+            return g.replica.engine
+        return super().get_bind(mapper, clause)
+
+
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    '''
+    SharedEngineSQLAlchemy
+        caches engines by URL and options, so every app made by create_app in a process,
+        e.g. one per test case, shares one engine and one connection pool.
+        Sessions are RoutingSessions.
+    '''
+
+    engines = {}
+    engines_lock = threading.Lock()
+
+    def create_engine(self, sa_url, engine_opts):
+        key = (str(sa_url), repr(sorted(engine_opts.items())))
+        with self.engines_lock:
+            if key not in self.engines:
+                self.engines[key] = super().create_engine(sa_url, engine_opts)
+            return self.engines[key]
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = SharedEngineSQLAlchemy()
+database_lock = threading.Lock()
+
+DATABASE_DEFAULTS = {
+    "DB_POOL_SIZE": 5,
+    "DB_MAX_OVERFLOW": 10,
+    "DB_POOL_TIMEOUT": 30,
+    "DB_POOL_RECYCLE": 1800,
+    "DB_POOL_PRE_PING": True,
+    "DB_STATEMENT_TIMEOUT": 0,
+    "DB_CREATE_IF_MISSING": False,
+    "DATABASE_REPLICAS": "",
+    "DB_REPLICA_BALANCING": "round_robin",
+    "DB_REPLICA_STICKY_SECONDS": 5,
+    "DB_REPLICA_HEALTH_INTERVAL": 5
+}
+
+ASYNC_DRIVERS = {"postgres": "postgresql+asyncpg", "postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    TimedQueuePool
+        a QueuePool that records how long checkouts wait for a free connection.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            self.waits += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+
+def get_setting(app, name):
+    '''
+    get_setting(app, name)
+        reads a database setting from the app config, then the environment, then DATABASE_DEFAULTS.
+    '''
+    if name in app.config:
+        return app.config[name]
+    default = DATABASE_DEFAULTS[name]
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+
+def engine_options(app, path):
+    if path.startswith("sqlite"):
+        return {}
+
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": get_setting(app, "DB_POOL_SIZE"),
+        "max_overflow": get_setting(app, "DB_MAX_OVERFLOW"),
+        "pool_timeout": get_setting(app, "DB_POOL_TIMEOUT"),
+        "pool_recycle": get_setting(app, "DB_POOL_RECYCLE"),
+        "pool_pre_ping": get_setting(app, "DB_POOL_PRE_PING")
+    }
+    statement_timeout = get_setting(app, "DB_STATEMENT_TIMEOUT")
+    if statement_timeout and path.startswith("postgres"):
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+def async_database_path(path):
+    scheme, rest = path.split("://", 1)
+    return f"{ASYNC_DRIVERS[scheme.split('+')[0]]}://{rest}"
 
-db = SQLAlchemy()
 
 '''
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+create_async_engine(app)
+    returns an async engine (asyncpg or aiosqlite) on the app's database with the same
+    pool settings and statement timeout as the sync engine.
 '''
 
 
-def setup_db(app, database_path=database_path):
+def create_async_engine(app):
+    from sqlalchemy.ext.asyncio import create_async_engine as create_engine
+
+    path = app.config["SQLALCHEMY_DATABASE_URI"]
+    options = engine_options(app, path)
+    options.pop("poolclass", None)
+    if "connect_args" in options:
+        statement_timeout = get_setting(app, "DB_STATEMENT_TIMEOUT")
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(statement_timeout)}}
+    return create_engine(async_database_path(path), **options)
+
+
+'''
+setup_db(app, database_path)
+    binds a flask application and a SQLAlchemy service.
+    The database path defaults to DATABASE_URL from the app config or the environment.
+    Pool settings (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING)
+    and DB_STATEMENT_TIMEOUT in milliseconds are read the same way.
+    The database is only created when DB_CREATE_IF_MISSING is set, which costs a round trip
+    and is deferred to the first request.
+'''
+
+
+def setup_db(app, database_path=None):
+    database_path = database_path or app.config.get("DATABASE_URL") or os.environ.get("DATABASE_URL") \
+        or default_database_path
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, database_path)
     db.app = app
     db.init_app(app)
 
-    if not database_exists(database_path):
-        create_database(database_path)
+    if get_setting(app, "DB_CREATE_IF_MISSING") and "database_checked" not in app.extensions:
+        app.extensions["database_checked"] = False
+        app.before_request(lambda: create_database_if_missing(app))
+
+
+def create_database_if_missing(app):
+    if app.extensions["database_checked"]:
+        return
+    from sqlalchemy_utils import database_exists, create_database
+
+    with database_lock:
+        database_path = app.config["SQLALCHEMY_DATABASE_URI"]
+        if not app.extensions["database_checked"] and not database_exists(database_path):
+            create_database(database_path)
+        app.extensions["database_checked"] = True
+
+
+'''
+pool_metrics()
+    returns the connection pool state of the current app's engine.
+'''
+
+
+def pool_metrics():
+    pool = db.engine.pool
+    metrics = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            metrics[name] = getattr(pool, name)()
+    if isinstance(pool, TimedQueuePool):
+        metrics["waits"] = pool.waits
+        metrics["wait_seconds_total"] = round(pool.wait_total, 6)
+        metrics["wait_seconds_max"] = round(pool.wait_max, 6)
+    return metrics
+
+
+def ping():
+    db.session.execute(text("SELECT 1"))
+
+
+'''
+add_question_listener(app, listener)
+    registers listener(action, question) to be called after a question is committed.
+    action is one of "insert", "update" or "delete" and question is its format() dict,
+    or "reload" with None after rows were written in bulk, behind the ORM.
+add_category_listener(app, listener)
+    the same for categories.
+'''
+
+
+def add_question_listener(app, listener):
+    app.extensions.setdefault("question_listeners", []).append(listener)
+
+
+def add_category_listener(app, listener):
+    app.extensions.setdefault("category_listeners", []).append(listener)
+
+
+def notify_listeners(key, action, record):
+    # models are also saved outside of an app context, e.g. by scripts and tests, after the commit
+    for listener in db.get_app().extensions.get(key, []):
+        listener(action, record)
+
+
+def notify_question_listeners(action, question):
+    notify_listeners("question_listeners", action, question)
+
+
+def notify_category_listeners(action, category):
+    notify_listeners("category_listeners", action, category)
 
 
 class Question(db.Model):
@@ -32,22 +249,31 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
+    __table_args__ = (
+        Index('questions_category_difficulty_id_idx', 'category', 'difficulty', 'id'),
+        Index('questions_difficulty_id_idx', 'difficulty', 'id')
+    )
+
     def __repr__(self):
         return f"Question <id: {self.id}, content: {self.question}"
 
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_listeners("insert", self.format())
 
     def update(self):
         db.session.commit()
+        notify_question_listeners("update", self.format())
 
     def delete(self):
+        question = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_question_listeners("delete", question)
 
     def format(self):
         return {
@@ -68,6 +294,21 @@ class Category(db.Model):
     def __repr__(self):
         return f"Category <id: {self.id}, type: {self.type}"
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        notify_category_listeners("insert", self.format())
+
+    def update(self):
+        db.session.commit()
+        notify_category_listeners("update", self.format())
+
+    def delete(self):
+        category = self.format()
+        db.session.delete(self)
+        db.session.commit()
+        notify_category_listeners("delete", category)
+
     def format(self):
         return {
             'id': self.id,
@@ -10,6 +10,7 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        sessionId: null,
         previousQuestions: [], 
         showAnswer: false,
         categories: {},
@@ -36,7 +37,39 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.startSession)
+  }
+
+  startSession = () => {
+    $.ajax({
+      url: '/quizzes/sessions',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_category: this.state.quizCategory
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ sessionId: result.session_id }, this.getNextQuestion)
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start the quiz. Please try your request again')
+        return;
+      }
+    })
+  }
+
+  finishSession = () => {
+    if(!this.state.sessionId) { return }
+    $.ajax({
+      url: `/quizzes/sessions/${this.state.sessionId}`,
+      type: "DELETE"
+    })
   }
 
   handleChange = (event) => {
@@ -48,14 +81,9 @@ class QuizView extends Component {
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
     $.ajax({
-      url: '/quizzes',
+      url: `/quizzes/sessions/${this.state.sessionId}/next`,
       type: "POST",
       dataType: 'json',
-      contentType: 'application/json',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
-      }),
       xhrFields: {
         withCredentials: true
       },
@@ -88,8 +116,10 @@ class QuizView extends Component {
   }
 
   restartGame = () => {
+    this.finishSession()
     this.setState({
       quizCategory: null,
+      sessionId: null,
       previousQuestions: [], 
       showAnswer: false,
       numCorrect: 0,
@@ -1,19 +1,45 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   }
 
   getInfo = (event) => {
     event.preventDefault();
-    this.props.submitSearch(this.state.query)
+    // a picked suggestion may be a shortened question
+    this.props.submitSearch(this.state.query.replace(/…$/, ''))
+  }
+
+  getSuggestions = (query) => {
+    $.ajax({
+      url: `/questions/suggest?q=${encodeURIComponent(query)}&limit=5`,
+      type: "GET",
+      success: (result) => {
+        // answers to earlier keystrokes may arrive late
+        if (query === this.state.query) {
+          this.setState({ suggestions: result.suggestions })
+        }
+        return;
+      },
+      error: (error) => {
+        return;
+      }
+    })
   }
 
   handleInputChange = () => {
+    const query = this.search.value
     this.setState({
-      query: this.search.value
+      query: query
     })
+    if (query.trim()) {
+      this.getSuggestions(query)
+    } else {
+      this.setState({ suggestions: [] })
+    }
   }
 
   render() {
@@ -21,9 +47,15 @@ class Search extends Component {
       <form onSubmit={this.getInfo}>
         <input
           placeholder="Search questions..."
+          list="search-suggestions"
           ref={input => this.search = input}
           onChange={this.handleInputChange}
         />
+        <datalist id="search-suggestions">
+          {this.state.suggestions.map(suggestion => (
+            <option key={suggestion.id} value={suggestion.snippet}/>
+          ))}
+        </datalist>
         <input type="submit" value="Submit" className="button"/>
       </form>
     )